@@ -0,0 +1,41 @@
+from django.urls import path, re_path
+
+from . import async_views
+from .urls import app_name, urlpatterns as sync_urlpatterns
+from .views import IngredientViewSet, RecipeViewSet
+
+__all__ = ('app_name', 'urlpatterns')
+
+# Чтение рецептов и ингредиентов - async-вьюхи, запись и остальные
+# маршруты - те же вьюхи DRF, что и в api.urls. Детальные маршруты
+# принимают только числовой id, иначе перехватили бы действия
+# вьюсета (например, recipes/download_shopping_cart/)
+urlpatterns = [
+    path('recipes/',
+         async_views.read_write_split(
+             async_views.recipe_list,
+             RecipeViewSet.as_view({'get': 'list', 'post': 'create'},
+                                   basename='recipe', detail=False)),
+         name='recipe-list'),
+    re_path(r'^recipes/(?P<pk>\d+)/$',
+            async_views.read_write_split(
+                async_views.recipe_detail,
+                RecipeViewSet.as_view({'get': 'retrieve',
+                                       'put': 'update',
+                                       'patch': 'partial_update',
+                                       'delete': 'destroy'},
+                                      basename='recipe', detail=True)),
+            name='recipe-detail'),
+    path('ingredients/',
+         async_views.read_write_split(
+             async_views.ingredient_list,
+             IngredientViewSet.as_view({'get': 'list'},
+                                       basename='ingredient', detail=False)),
+         name='ingredient-list'),
+    re_path(r'^ingredients/(?P<pk>\d+)/$',
+            async_views.read_write_split(
+                async_views.ingredient_detail,
+                IngredientViewSet.as_view({'get': 'retrieve'},
+                                          basename='ingredient', detail=True)),
+            name='ingredient-detail'),
+] + sync_urlpatterns
@@ -0,0 +1,183 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.paginator import InvalidPage
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from foodgram.models import Ingredient, Recipe
+from . import short_links
+from .conditional import (INGREDIENTS, RECIPES, conditional_state, recipe_scope,
+                          set_conditional_headers)
+from .ingredient_index import ingredient_index
+from .pagination import CachedCountPagination
+from .response_cache import cache_key, get_response, store_response
+from .serializers import IngredientSerializer, PostRecipeSerializer, RecipeSerializer
+from .views import filter_recipes, get_recipe_ordering, search_ingredients
+
+# Параметры, которые обслуживает только синхронная вьюха
+SYNC_ONLY_PARAMS = {'cursor', 'search', 'format'}
+
+
+async def authenticate(request):
+    """
+        Пользователь по заголовку Authorization: Token <key>, как в
+        TokenAuthentication. None, если токен неверный: такой запрос
+        обработает синхронная вьюха и вернет свою ошибку.
+    """
+    header = request.headers.get('Authorization', '').split()
+    if not header or header[0].lower() != 'token':
+        return AnonymousUser()
+    if len(header) != 2:
+        return None
+    token = await Token.objects.select_related('user').filter(key=header[1]).afirst()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+def read_write_split(read, sync_view):
+    """
+        Async-вьюха: GET обслуживает корутина read(request, user, **kwargs),
+        остальные методы и запросы, от которых read отказалась (вернула
+        None), - синхронная вьюха DRF в потоке.
+    """
+    fallback = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if (request.method == 'GET'
+                and 'text/html' not in request.headers.get('Accept', '')
+                and not SYNC_ONLY_PARAMS & request.GET.keys()):
+            user = await authenticate(request)
+            if user is not None:
+                response = await read(request, user, *args, **kwargs)
+                if response is not None:
+                    return response
+        return await fallback(request, *args, **kwargs)
+    return csrf_exempt(view)
+
+
+def _drf_request(request, user):
+    # Сериализаторам нужен request DRF с уже известным пользователем
+    drf_request = Request(request)
+    drf_request.user = user
+    return drf_request
+
+
+async def _respond(request, user, build, scopes, cache_scopes=None, per_viewer=False):
+    """
+        Условный GET и кэш анонимных ответов так же, как conditional_get
+        и cache_anonymous_response у синхронных вьюх.
+    """
+    etag, modified = conditional_state(request, user, scopes, per_viewer)
+    response = get_conditional_response(request, etag=etag, last_modified=modified)
+    if response is None:
+        key = None
+        if cache_scopes is not None and not user.is_authenticated:
+            key = cache_key(request, cache_scopes, JSONRenderer.format)
+            response = get_response(key)
+        if response is None:
+            data = await build()
+            if data is None:
+                return None
+            response = HttpResponse(JSONRenderer().render(data),
+                                    content_type=JSONRenderer.media_type)
+            if key is not None:
+                store_response(key, response)
+    return set_conditional_headers(response, etag, modified, per_viewer)
+
+
+async def recipe_list(request, user):
+    async def build():
+        drf_request = _drf_request(request, user)
+        queryset = filter_recipes(Recipe.objects.with_related().with_user_flags(user),
+                                  request.GET, user)
+        ordering = get_recipe_ordering(request.GET)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        pagination = CachedCountPagination()
+        pagination.request = drf_request
+        pagination.keyset = None
+        paginator = pagination.django_paginator_class(queryset,
+                                                      pagination.get_page_size(drf_request))
+        # count берется из кэша, при промахе считается в потоке
+        await sync_to_async(lambda: paginator.count)()
+        try:
+            pagination.page = paginator.page(request.GET.get(pagination.page_query_param, 1))
+        except InvalidPage:
+            return None
+        page = pagination.page
+        bottom = (page.number - 1) * paginator.per_page
+        page.object_list = [recipe async for recipe in
+                            queryset[bottom:bottom + paginator.per_page]]
+        serializer = PostRecipeSerializer(page.object_list, many=True,
+                                          context={'request': drf_request,
+                                                   'image_variant': 'card'})
+        return pagination.get_paginated_response(serializer.data).data
+
+    return await _respond(request, user, build, [RECIPES],
+                          cache_scopes=[RECIPES], per_viewer=True)
+
+
+async def recipe_detail(request, user, pk):
+    if not pk.isdigit():
+        return None
+
+    async def build():
+        recipe = await (Recipe.objects
+                        .with_related()
+                        .with_user_flags(user)
+                        .filter(pk=pk)
+                        .afirst())
+        if recipe is None:
+            return None
+        return PostRecipeSerializer(recipe, context={'request': _drf_request(request, user)}).data
+
+    return await _respond(request, user, build, [RECIPES],
+                          cache_scopes=[recipe_scope(pk)], per_viewer=True)
+
+
+async def ingredient_list(request, user):
+    async def build():
+        await ingredient_index.aprepare()
+        return search_ingredients(request.GET)
+
+    return await _respond(request, user, build, [INGREDIENTS])
+
+
+async def ingredient_detail(request, user, pk):
+    if not pk.isdigit():
+        return None
+
+    async def build():
+        ingredient = await Ingredient.objects.filter(pk=pk).afirst()
+        return IngredientSerializer(ingredient).data if ingredient is not None else None
+
+    return await _respond(request, user, build, [INGREDIENTS])
+
+
+async def short_link(request, user, hashid):
+    drf_request = _drf_request(request, user)
+
+    async def load(recipe_id):
+        recipe = await (Recipe.objects
+                        .with_related()
+                        .with_user_flags(user)
+                        .prefetch_related('ingredients')
+                        .filter(pk=recipe_id)
+                        .afirst())
+        if recipe is None:
+            return None
+        return RecipeSerializer(recipe, context={'request': drf_request}).data
+
+    if user.is_authenticated:
+        recipe_id = await short_links.aresolve(hashid)
+        payload = await load(recipe_id) if recipe_id is not None else None
+    else:
+        payload = await short_links.aget_payload(request, hashid, load)
+    if payload is None:
+        return None
+    return HttpResponse(JSONRenderer().render(payload), content_type=JSONRenderer.media_type)
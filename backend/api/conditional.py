@@ -0,0 +1,106 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from foodgram.models import TrendingRecipe
+
+RECIPES = 'recipes'
+INGREDIENTS = 'ingredients'
+
+
+def _key(scope):
+    return f'conditional:{scope}'
+
+
+def recipe_scope(recipe_id):
+    """Область одного рецепта: сам рецепт, его ингредиенты и автор"""
+    return f'recipe:{recipe_id}'
+
+
+def viewer_scope(user_id):
+    """Область избранного, корзины и подписок конкретного пользователя"""
+    return f'viewer:{user_id}'
+
+
+def trending_scope(request):
+    """
+        Область снимка популярных рецептов. Снимок пишет update_trending
+        из другого процесса, поэтому версия берется из БД, а не из кэша:
+        каждый новый снимок - новая область. Считается раз на запрос.
+    """
+    if not hasattr(request, '_trending_scope'):
+        computed_at = TrendingRecipe.objects.aggregate(last=Max('computed_at'))['last']
+        request._trending_scope = f'trending:{computed_at.timestamp() if computed_at else 0}'
+    return request._trending_scope
+
+
+def touch(*scopes):
+    """
+        Отмечает изменение данных: меняет ETag и Last-Modified областей.
+        Внутри транзакции отметка ставится после фиксации, иначе
+        параллельный GET прочитал бы старые строки под новым ETag.
+    """
+    def bump():
+        now = time.time()
+        cache.set_many({_key(scope): now for scope in scopes}, timeout=None)
+    transaction.on_commit(bump)
+
+
+def last_modified(scopes):
+    """Время последнего изменения каждой области (неизвестное - сейчас)"""
+    keys = [_key(scope) for scope in scopes]
+    stamps = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in stamps}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        stamps.update(missing)
+    return [stamps[key] for key in keys]
+
+
+def conditional_state(request, user, scopes, per_viewer=False):
+    """ETag и время последнего изменения ответа на запрос"""
+    # Области-функции (trending_scope) вычисляются на каждый запрос
+    all_scopes = [scope(request) if callable(scope) else scope for scope in scopes]
+    if per_viewer and user.is_authenticated:
+        all_scopes.append(viewer_scope(user.pk))
+    stamps = last_modified(all_scopes)
+    digest = hashlib.md5(
+        f'{stamps}:{user.pk}:{request.get_full_path()}'.encode()
+    ).hexdigest()
+    return f'"{digest}"', int(max(stamps))
+
+
+def set_conditional_headers(response, etag, modified, per_viewer=False):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+    if per_viewer:
+        patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def conditional_get(*scopes, per_viewer=False):
+    """
+        Условный GET для методов вьюсета: ETag и Last-Modified строятся
+        по отметкам изменений областей (и пользователя, если per_viewer),
+        при совпадении If-None-Match / If-Modified-Since отдается 304
+        без выполнения запроса и сериализации.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            etag, modified = conditional_state(request, request.user, scopes, per_viewer)
+            response = get_conditional_response(request,
+                                                etag=etag,
+                                                last_modified=modified)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+            return set_conditional_headers(response, etag, modified, per_viewer)
+        return wrapper
+    return decorator
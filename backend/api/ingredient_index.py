@@ -0,0 +1,209 @@
+import asyncio
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from foodgram.models import Ingredient
+
+INDEX_VERSION_KEY = 'ingredients:index-version'
+WORD_RE = re.compile(r'\w+')
+# Сколько результатов ранжированного поиска помнит каждый срез индекса
+RANKED_CACHE_SIZE = 4096
+
+
+def ngrams(word, size=3):
+    """N-граммы слова с отступом в начале: короткие префиксы тоже дают граммы"""
+    padded = ' ' * (size - 1) + word
+    return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+
+def prefix_distance(query, word, max_distance):
+    """
+        Расстояние Левенштейна от query до ближайшего префикса word.
+        Возвращает max_distance + 1, если расстояние больше порога.
+    """
+    word = word[:len(query) + max_distance]
+    previous = list(range(len(word) + 1))
+    for i, query_char in enumerate(query, 1):
+        current = [i]
+        for j, word_char in enumerate(word, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (query_char != word_char)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous)
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class _Snapshot:
+    """Неизменяемый срез каталога со всеми структурами поиска"""
+
+    def __init__(self, rows):
+        rows = sorted(((name.casefold(), ingredient_id, name, unit)
+                       for ingredient_id, name, unit in rows),
+                      key=lambda row: (row[0], row[1]))
+        # Отсортированные названия в casefold и элементы в том же порядке
+        self.keys = [row[0] for row in rows]
+        self.items = [{'id': ingredient_id,
+                       'name': name,
+                       'measurement_unit': unit}
+                      for _, ingredient_id, name, unit in rows]
+        self.by_id = sorted(self.items, key=lambda item: item['id'])
+        self.words = [WORD_RE.findall(key) for key in self.keys]
+
+        # Начала слов внутри названия: (слово, позиция элемента)
+        self.word_starts = sorted(
+            (word, position)
+            for position, words in enumerate(self.words)
+            for word in words[1:])
+        self.word_start_keys = [word for word, _ in self.word_starts]
+
+        # Словарь различных слов и инвертированный индекс их триграмм
+        word_positions = defaultdict(list)
+        for position, words in enumerate(self.words):
+            for word in set(words):
+                word_positions[word].append(position)
+        self.vocabulary = list(word_positions)
+        self.word_positions = [word_positions[word] for word in self.vocabulary]
+        grams = defaultdict(list)
+        for word_id, word in enumerate(self.vocabulary):
+            for gram in ngrams(word):
+                grams[gram].append(word_id)
+        self.grams = dict(grams)
+        self.ranked = lru_cache(maxsize=RANKED_CACHE_SIZE)(self._ranked)
+
+    def prefix(self, prefix):
+        for position in range(bisect_left(self.keys, prefix), len(self.keys)):
+            if not self.keys[position].startswith(prefix):
+                break
+            yield position
+
+    def word_prefix(self, prefix):
+        keys = self.word_start_keys
+        for index in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[index].startswith(prefix):
+                break
+            yield self.word_starts[index][1]
+
+    def fuzzy(self, query, max_distance):
+        query_grams = ngrams(query)
+        overlap = Counter()
+        for gram in query_grams:
+            overlap.update(self.grams.get(gram, ()))
+        # Одна правка портит не больше трех триграмм запроса
+        min_overlap = max(1, len(query_grams) - 3 * max_distance)
+        best = {}
+        for word_id, shared in overlap.items():
+            if shared < min_overlap:
+                continue
+            distance = prefix_distance(query, self.vocabulary[word_id], max_distance)
+            if distance > max_distance:
+                continue
+            for position in self.word_positions[word_id]:
+                if distance < best.get(position, max_distance + 1):
+                    best[position] = distance
+        for position in sorted(best, key=lambda position: (best[position], position)):
+            yield position
+
+    def _ranked(self, query, limit, max_typos):
+        tiers = [self.prefix(query), self.word_prefix(query)]
+        if max_typos and ' ' not in query:
+            tiers.append(self.fuzzy(query, max_typos))
+
+        seen = set()
+        result = []
+        for tier in tiers:
+            for position in tier:
+                if position in seen:
+                    continue
+                seen.add(position)
+                result.append(self.items[position])
+                if len(result) >= limit:
+                    return result
+        return result
+
+
+class IngredientIndex:
+    """
+        Индекс каталога ингредиентов в памяти процесса: отсортированный
+        список названий в casefold для поиска по префиксу бинарным поиском,
+        начала слов и триграммы для ранжированного поиска с опечатками.
+        Строится при первом обращении и перестраивается после изменения
+        таблицы Ingredient (версия хранится в кэше Django, чтобы о
+        перестроении узнали все процессы при общем кэше).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._snapshot = _Snapshot([])
+
+    def _current_version(self):
+        return cache.get(INDEX_VERSION_KEY, 0)
+
+    def _get_snapshot(self):
+        version = self._current_version()
+        # В event loop запрос к БД невозможен: до aprepare() отдается текущий срез
+        if self._version != version and not _in_event_loop():
+            with self._lock:
+                if self._version != version:
+                    self._snapshot = _Snapshot(
+                        Ingredient.objects.values_list('id', 'name', 'measurement_unit'))
+                    self._version = version
+        return self._snapshot
+
+    async def aprepare(self):
+        """Перестраивает устаревший срез в потоке, не блокируя event loop"""
+        if self._version != self._current_version():
+            await sync_to_async(self._get_snapshot)()
+
+    def invalidate(self):
+        try:
+            cache.incr(INDEX_VERSION_KEY)
+        except ValueError:
+            cache.set(INDEX_VERSION_KEY, 1, timeout=None)
+        self._version = None
+
+    def all(self):
+        """Весь каталог в порядке id, как его отдает БД"""
+        return self._get_snapshot().by_id
+
+    def search(self, prefix):
+        """Ингредиенты, название которых начинается с prefix (без учета регистра)"""
+        snapshot = self._get_snapshot()
+        return [snapshot.items[position]
+                for position in snapshot.prefix(prefix.casefold())]
+
+    def ranked_search(self, query, limit=None):
+        """
+            Ранжированный поиск: сначала совпадения по началу названия,
+            затем по началу слова внутри названия, затем слова с опечатками
+            (расстояние правки до INGREDIENT_SEARCH_MAX_TYPOS).
+        """
+        snapshot = self._get_snapshot()
+        query = ' '.join(WORD_RE.findall(query.casefold()))
+        if not query:
+            return []
+        # Одна опечатка на каждые четыре символа запроса
+        max_typos = min(settings.INGREDIENT_SEARCH_MAX_TYPOS, (len(query) + 1) // 4)
+        return snapshot.ranked(query,
+                               limit or settings.INGREDIENT_SEARCH_LIMIT,
+                               max_typos)
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,233 @@
+import io
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from foodgram.models import Recipe, User
+from .bench_read_path import percentile
+
+# Размеры наборов данных для generate_dataset
+DATASETS = {
+    'small': {'users': 200, 'recipes': 1000},
+    'medium': {'users': 2000, 'recipes': 10000},
+    'large': {'users': 20000, 'recipes': 100000},
+}
+PREFIX = 'bench'
+
+
+class Command(BaseCommand):
+    help = ('Benchmark API endpoints on generated datasets in a throwaway test database: '
+            'p50/p95 latency, query count and peak allocated memory per endpoint. '
+            'Uses the configured database (DB_ENGINE=sqlite for offline runs).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*',
+                            help=f'Dataset sizes: {", ".join(DATASETS)}; small by default')
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='benchmark.json',
+                            help='Where to write the JSON report')
+        parser.add_argument('--baseline',
+                            help='Earlier report to compare with')
+        parser.add_argument('--max-regression', type=float,
+                            help='Fail if p95 grows by more than this many percent '
+                                 'or an endpoint makes more queries than in the baseline')
+
+    def handle(self, *args, **options):
+        options['sizes'] = options['sizes'] or ['small']
+        unknown = set(options['sizes']) - DATASETS.keys()
+        if unknown:
+            raise CommandError(f'Unknown dataset sizes: {", ".join(sorted(unknown))}')
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+
+        report = {
+            'meta': {
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'seed': options['seed'],
+                'iterations': options['iterations'],
+                'datasets': {size: DATASETS[size] for size in options['sizes']},
+                'generated_at': timezone.now().isoformat(),
+            },
+            'results': {},
+        }
+        setup_test_environment()
+        try:
+            for size in options['sizes']:
+                report['results'][size] = self._bench_dataset(size, options)
+        finally:
+            teardown_test_environment()
+
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
+        if baseline is not None:
+            self._compare(baseline, report, options['max_regression'])
+
+    def _bench_dataset(self, size, options):
+        # Отдельная тестовая БД: рабочие данные не трогаем
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            # Набор читается в этом же процессе, общий кэш не нужен
+            call_command('generate_dataset', seed=options['seed'], prefix=PREFIX,
+                         allow_local_cache=True, stdout=io.StringIO(), **DATASETS[size])
+            self.stdout.write(f'{size}: dataset generated in '
+                              f'{time.perf_counter() - started:.1f} s')
+            cache.clear()
+            viewer = self._viewer()
+            results = self._run(self._steps(viewer), viewer, options['iterations'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self._print(size, results)
+        return results
+
+    def _viewer(self):
+        """Самый тяжелый читатель: больше всего подписок и непустая корзина"""
+        return (User.objects
+                .filter(username__startswith=f'{PREFIX}_', shoplist__recipes__isnull=False)
+                .annotate(follows=Count('subcriptions', distinct=True))
+                .order_by('-follows', 'pk')
+                .first())
+
+    def _steps(self, viewer):
+        """(название, метод, url, параметры, от имени пользователя)"""
+        users = User.objects.filter(username__startswith=f'{PREFIX}_')
+        author = users.annotate(total=Count('recipes')).order_by('-total', 'pk').first()
+        popular = (Recipe.objects.annotate(total=Count('favorite'))
+                   .order_by('-total', 'pk').values_list('pk', flat=True).first())
+        toggled = (Recipe.objects
+                   .exclude(favorite__user=viewer)
+                   .exclude(shop_lists__user=viewer)
+                   .values_list('pk', flat=True).first())
+
+        recipes = reverse('foodgram_api:recipe-list')
+        return [
+            ('recipes_list_anonymous', 'get', recipes, {}, False),
+            ('recipes_list', 'get', recipes, {}, True),
+            ('recipes_list_page_10', 'get', recipes, {'page': 10}, True),
+            ('recipes_filter_author', 'get', recipes, {'author': author.pk}, True),
+            ('recipes_filter_favorited', 'get', recipes, {'is_favorited': 1}, True),
+            ('recipes_filter_in_cart', 'get', recipes, {'is_in_shopping_cart': 1}, True),
+            ('recipe_detail', 'get',
+             reverse('foodgram_api:recipe-detail', kwargs={'pk': popular}), {}, True),
+            ('subscriptions', 'get', reverse('foodgram_api:user-subscriptions'), {}, True),
+            ('ingredient_search', 'get', reverse('foodgram_api:ingredient-list'),
+             {'name': 'мук'}, False),
+            ('download_shopping_cart', 'get',
+             reverse('foodgram_api:download_shopping_cart'), {}, True),
+            ('favorite_add', 'post',
+             reverse('foodgram_api:recipe-favorite', kwargs={'pk': toggled}), {}, True),
+            ('favorite_remove', 'delete',
+             reverse('foodgram_api:recipe-favorite', kwargs={'pk': toggled}), {}, True),
+            ('cart_add', 'post',
+             reverse('foodgram_api:recipe-shopping-cart', kwargs={'pk': toggled}), {}, True),
+            ('cart_remove', 'delete',
+             reverse('foodgram_api:recipe-shopping-cart', kwargs={'pk': toggled}), {}, True),
+        ]
+
+    def _run(self, steps, viewer, iterations):
+        token = Token.objects.get_or_create(user=viewer)[0]
+        anonymous = APIClient()
+        authorized = APIClient()
+        authorized.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        def request(step):
+            name, method, url, params, auth = step
+            client = authorized if auth else anonymous
+            if method == 'get':
+                response = client.get(url, params)
+            else:
+                response = getattr(client, method)(url, params, format='json')
+            if response.streaming:
+                # Потоковый ответ (скачивание корзины) строится при чтении тела
+                b''.join(response.streaming_content)
+            return response
+
+        # Шаги идут по кругу: добавление и удаление чередуются
+        for step in steps:
+            request(step)
+        latencies = {step[0]: [] for step in steps}
+        errors = dict.fromkeys(latencies, 0)
+        for _ in range(iterations):
+            for step in steps:
+                started = time.perf_counter()
+                response = request(step)
+                latencies[step[0]].append(time.perf_counter() - started)
+                errors[step[0]] += response.status_code >= 400
+
+        # Запросы и память считаются отдельным проходом, чтобы
+        # tracemalloc не искажал время
+        results = {}
+        tracemalloc.start()
+        try:
+            for step in steps:
+                name, method, url, params, auth = step
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                with CaptureQueriesContext(connection) as queries:
+                    request(step)
+                peak = tracemalloc.get_traced_memory()[1] - before
+                times = latencies[name]
+                results[name] = {
+                    'method': method.upper(),
+                    'path': url,
+                    'params': params,
+                    'p50_ms': round(statistics.median(times) * 1000, 2),
+                    'p95_ms': round(percentile(times, 95) * 1000, 2),
+                    'mean_ms': round(statistics.fmean(times) * 1000, 2),
+                    'queries': len(queries),
+                    'peak_memory_kb': round(peak / 1024, 1),
+                    'errors': errors[name],
+                }
+        finally:
+            tracemalloc.stop()
+        return results
+
+    def _print(self, size, results):
+        self.stdout.write(f'{"endpoint":<28}{"p50 ms":>9}{"p95 ms":>9}'
+                          f'{"queries":>9}{"mem KB":>9}{"errors":>8}')
+        for name, row in results.items():
+            self.stdout.write(f'{name:<28}{row["p50_ms"]:>9}{row["p95_ms"]:>9}'
+                              f'{row["queries"]:>9}{row["peak_memory_kb"]:>9}{row["errors"]:>8}')
+
+    def _compare(self, baseline, report, max_regression):
+        regressions = []
+        self.stdout.write('Compared with baseline:')
+        for size, results in report['results'].items():
+            for name, row in results.items():
+                old = baseline.get('results', {}).get(size, {}).get(name)
+                if old is None:
+                    continue
+                change = ((row['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+                          if old['p95_ms'] else 0)
+                queries = row['queries'] - old['queries']
+                self.stdout.write(f'  {size}/{name}: p95 {old["p95_ms"]} -> {row["p95_ms"]} ms '
+                                  f'({change:+.0f}%), queries {old["queries"]} -> '
+                                  f'{row["queries"]}')
+                if max_regression is not None and (change > max_regression or queries > 0):
+                    regressions.append(f'{size}/{name}')
+        if regressions:
+            raise CommandError(f'Regressions: {", ".join(regressions)}')
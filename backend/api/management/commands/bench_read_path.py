@@ -0,0 +1,137 @@
+import asyncio
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+
+DEFAULT_PATHS = ('/api/recipes/', '/api/recipes/?page=2', '/api/ingredients/?name=мук',
+                 '/s/mXw')
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Measure read throughput of the WSGI (sync DRF) or ASGI (async views) path '
+            'in-process. Run once per server: ASYNC_READ_VIEWS=True for asgi.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('server', choices=('wsgi', 'asgi'))
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--db-latency-ms', type=float, default=0,
+                            help='Sleep added to every query to emulate a remote database')
+        parser.add_argument('--token', default='',
+                            help='Authorization token; anonymous requests by default')
+        parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS)
+
+    def handle(self, *args, **options):
+        server = options['server']
+        if (server == 'asgi') != settings.ASYNC_READ_VIEWS:
+            raise CommandError('Set ASYNC_READ_VIEWS=True for asgi and leave it unset for wsgi')
+        if options['db_latency_ms']:
+            self._add_db_latency(options['db_latency_ms'] / 1000)
+
+        # Запросы кодируются, как их прислал бы клиент
+        paths = [urlsplit(quote(options['paths'][i % len(options['paths'])], safe='/?=&'))
+                 for i in range(options['requests'])]
+        headers = {'Authorization': f'Token {options["token"]}'} if options['token'] else {}
+        run = self._run_asgi if server == 'asgi' else self._run_wsgi
+        started = time.perf_counter()
+        latencies, errors = run(paths, headers, options['concurrency'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'{server}: {len(paths)} requests, concurrency {options["concurrency"]}, '
+            f'db latency {options["db_latency_ms"]} ms\n'
+            f'  throughput {len(paths) / elapsed:.1f} req/s, errors {errors}\n'
+            f'  latency p50 {statistics.median(latencies) * 1000:.1f} ms, '
+            f'p95 {percentile(latencies, 95) * 1000:.1f} ms')
+
+    def _add_db_latency(self, delay):
+        def wrapper(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        # Соединения открываются в каждом потоке отдельно
+        def install(sender, connection, **kwargs):
+            connection.execute_wrappers.append(wrapper)
+        connection_created.connect(install, weak=False)
+
+    def _run_wsgi(self, paths, headers, concurrency):
+        application = get_wsgi_application()
+        environ_headers = {f'HTTP_{name.upper().replace("-", "_")}': value
+                           for name, value in headers.items()}
+        lock = threading.Lock()
+        latencies = []
+        errors = 0
+
+        def call(url):
+            nonlocal errors
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path,
+                       'QUERY_STRING': url.query, 'SERVER_NAME': 'localhost',
+                       'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                       'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+                       **environ_headers}
+            statuses = []
+            started = time.perf_counter()
+            body = application(environ, lambda status, response_headers: statuses.append(status))
+            b''.join(body)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors += not statuses[0].startswith('2')
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(call, paths))
+        return latencies, errors
+
+    def _run_asgi(self, paths, headers, concurrency):
+        application = get_asgi_application()
+        raw_headers = [(b'host', b'localhost')] + [
+            (name.lower().encode(), value.encode()) for name, value in headers.items()]
+
+        async def call(url, latencies, statuses):
+            scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                     'method': 'GET', 'scheme': 'http', 'path': url.path,
+                     'raw_path': url.path.encode(), 'query_string': url.query.encode(),
+                     'root_path': '', 'headers': raw_headers,
+                     'client': ('127.0.0.1', 0), 'server': ('localhost', 80)}
+
+            requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if requests:
+                    return requests.pop()
+                # Клиент не отключается: ждем, пока Django отменит ожидание
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            latencies.append(time.perf_counter() - started)
+
+        async def main():
+            latencies, statuses = [], []
+            queue = list(reversed(paths))
+
+            async def worker():
+                while queue:
+                    await call(queue.pop(), latencies, statuses)
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return latencies, sum(not 200 <= code < 300 for code in statuses)
+
+        return asyncio.run(main())
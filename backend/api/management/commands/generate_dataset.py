@@ -0,0 +1,249 @@
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from foodgram.management.shared_cache import add_local_cache_argument, require_shared_cache
+from foodgram.models import (Favorite, FeedItem, Ingredient, Recipe, RecipeIngredient,
+                             ShopList, ShopListIngredient, Subscription, User)
+from api.conditional import RECIPES, touch
+from api.pagination import bump_count_version
+from api.search import update_search_index
+
+# Показатель степени закона Ципфа для популярности авторов и рецептов
+ZIPF_EXPONENT = 1.1
+# Показатель распределения Парето для числа подписок пользователя
+PARETO_ALPHA = 1.5
+WEIGHT_UNITS = {'г', 'мл', 'кг', 'л'}
+
+
+def zipf_weights(size):
+    """Накопленные веса: первый элемент популярнее k-го в k^s раз"""
+    return list(itertools.accumulate(1 / rank ** ZIPF_EXPONENT for rank in range(1, size + 1)))
+
+
+def sample_distinct(rng, population, cum_weights, count):
+    """count разных элементов с весами; для длинного хвоста может вернуть меньше"""
+    count = min(count, len(population))
+    picks = set()
+    for _ in range(20):
+        if len(picks) >= count:
+            break
+        picks.update(rng.choices(population, cum_weights=cum_weights, k=count - len(picks)))
+    return picks
+
+
+@contextmanager
+def explicit_created_at():
+    # auto_now_add перезаписал бы разнесенные по времени даты
+    field = Recipe._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ('Generate a deterministic synthetic dataset (users, recipes, favorites, '
+            'power-law subscriptions, shopping carts) with bulk inserts')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synth',
+                            help='Username prefix of generated users')
+        parser.add_argument('--password', default='synthetic',
+                            help='Password shared by generated users')
+        parser.add_argument('--author-share', type=float, default=0.2,
+                            help='Share of users who publish recipes')
+        parser.add_argument('--avg-favorites', type=float, default=20)
+        parser.add_argument('--avg-follows', type=float, default=10,
+                            help='Mean of the power-law number of followed authors')
+        parser.add_argument('--max-follows', type=int, default=5000)
+        parser.add_argument('--cart-share', type=float, default=0.3,
+                            help='Share of users with a non-empty shopping cart')
+        parser.add_argument('--max-cart', type=int, default=10)
+        parser.add_argument('--days', type=int, default=365,
+                            help='Recipes are spread over this many past days')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        add_local_cache_argument(parser)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1 or options['batch_size'] < 1:
+            raise CommandError('Need at least 2 users, 1 recipe and a positive batch size')
+        require_shared_cache(options)
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.catalogue = list(Ingredient.objects.order_by('pk')
+                              .values_list('pk', 'name', 'measurement_unit'))
+        if not self.catalogue:
+            raise CommandError('The ingredient catalogue is empty, run load_ingredients first')
+        if User.objects.filter(username__startswith=f'{options["prefix"]}_').exists():
+            raise CommandError(f'Users with prefix {options["prefix"]!r} already exist, '
+                               f'choose another --prefix')
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            user_ids = self._stage('users', self._create_users)
+            author_ids = user_ids[:max(1, int(len(user_ids) * options['author_share']))]
+            recipe_ids = self._stage('recipes', self._create_recipes, author_ids)
+            # Популярность не связана с возрастом рецепта и порядком авторов
+            popular_recipes = self.rng.sample(recipe_ids, len(recipe_ids))
+            popular_authors = self.rng.sample(author_ids, len(author_ids))
+            self._stage('favorites', self._create_favorites, user_ids, popular_recipes)
+            self._stage('subscriptions', self._create_subscriptions, user_ids, popular_authors)
+            self._stage('feeds', self._materialize_feeds)
+            self._stage('shopping carts', self._create_carts, user_ids, popular_recipes)
+        bump_count_version()
+        touch(RECIPES)
+        self.stdout.write(self.style.SUCCESS(
+            f'Dataset generated in {time.perf_counter() - started:.1f} s'))
+
+    def _stage(self, name, create, *args):
+        started = time.perf_counter()
+        result, rows = create(*args)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{name}: {rows} rows in {elapsed:.1f} s '
+                          f'({rows / elapsed if elapsed else 0:.0f} rows/s)')
+        return result
+
+    def _insert(self, model, objects):
+        """bulk_create порциями по batch_size; возвращает id созданных строк"""
+        ids = []
+        objects = iter(objects)
+        while batch := list(itertools.islice(objects, self.batch_size)):
+            ids += [obj.pk for obj in model.objects.bulk_create(batch)]
+        return ids
+
+    def _create_users(self):
+        prefix = self.options['prefix']
+        password = make_password(self.options['password'])
+        ids = self._insert(User, (
+            User(username=f'{prefix}_{number}', email=f'{prefix}_{number}@example.com',
+                 first_name=f'Имя{number}', last_name=f'Фамилия{number}',
+                 password=password)
+            for number in range(self.options['users'])))
+        return ids, len(ids)
+
+    def _create_recipes(self, author_ids):
+        rng = self.rng
+        authors = rng.choices(author_ids, cum_weights=zipf_weights(len(author_ids)),
+                              k=self.options['recipes'])
+        now = timezone.now()
+        window = self.options['days'] * 24 * 3600
+        # Более поздние рецепты получают большие id, как в жизни
+        offsets = sorted((rng.uniform(0, window) for _ in authors), reverse=True)
+        ingredient_sets = []
+        recipes = []
+        for number, (author_id, offset) in enumerate(zip(authors, offsets)):
+            size = min(len(self.catalogue), max(1, min(20, round(rng.gauss(8, 3)))))
+            ingredients = rng.sample(self.catalogue, size)
+            ingredient_sets.append(ingredients)
+            main = ingredients[0][1]
+            recipes.append(Recipe(
+                author_id=author_id,
+                name=f'{main.capitalize()} №{number}',
+                image='recipes/synthetic.png',
+                text='Смешать ' + ', '.join(name for _, name, _ in ingredients) + '.',
+                cooking_time=max(1, min(600, round(rng.lognormvariate(3.4, 0.6)))),
+                created_at=now - timedelta(seconds=offset)))
+
+        ids = []
+        rows = 0
+        for start in range(0, len(recipes), self.batch_size):
+            with explicit_created_at():
+                batch = Recipe.objects.bulk_create(recipes[start:start + self.batch_size])
+            links = [RecipeIngredient(recipe_id=recipe.pk, ingredient_id=ingredient_id,
+                                      amount=self._amount(unit))
+                     for recipe, ingredients
+                     in zip(batch, ingredient_sets[start:start + self.batch_size])
+                     for ingredient_id, _, unit in ingredients]
+            RecipeIngredient.objects.bulk_create(links, batch_size=self.batch_size)
+            batch_ids = [recipe.pk for recipe in batch]
+            update_search_index(batch_ids)
+            ids += batch_ids
+            rows += len(batch) + len(links)
+        return ids, rows
+
+    def _amount(self, unit):
+        if unit in WEIGHT_UNITS:
+            return self.rng.choice((10, 20, 50, 100, 150, 200, 250, 300, 500))
+        return self.rng.randint(1, 5)
+
+    def _create_favorites(self, user_ids, popular_recipes):
+        weights = zipf_weights(len(popular_recipes))
+        average = self.options['avg_favorites']
+        ids = self._insert(Favorite, (
+            Favorite(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in sorted(sample_distinct(
+                self.rng, popular_recipes, weights,
+                int(self.rng.expovariate(1 / average)) if average else 0))))
+        # bulk_create не посылает post_save: счетчики считаются одним UPDATE
+        Recipe.objects.filter(
+            author__username__startswith=f'{self.options["prefix"]}_'
+        ).refresh_favorites_count()
+        return None, len(ids)
+
+    def _create_subscriptions(self, user_ids, popular_authors):
+        weights = zipf_weights(len(popular_authors))
+        # Среднее распределения Парето равно alpha / (alpha - 1)
+        scale = self.options['avg_follows'] * (PARETO_ALPHA - 1) / PARETO_ALPHA
+        max_follows = self.options['max_follows']
+
+        def follows(user_id):
+            count = min(max_follows, int(scale * self.rng.paretovariate(PARETO_ALPHA)))
+            authors = sample_distinct(self.rng, popular_authors, weights, count)
+            authors.discard(user_id)
+            return sorted(authors)
+
+        ids = self._insert(Subscription, (
+            Subscription(user_id=user_id, subscribed_to_id=author_id)
+            for user_id in user_ids for author_id in follows(user_id)))
+        return None, len(ids)
+
+    def _materialize_feeds(self):
+        # bulk_create не посылает post_save: ленты подписчиков выше
+        # FEED_FANOUT_THRESHOLD строятся так же, как в rebuild_feeds
+        FeedItem.objects.sync(settings.FEED_FANOUT_THRESHOLD, self.batch_size)
+        return None, FeedItem.objects.filter(
+            user__username__startswith=f'{self.options["prefix"]}_').count()
+
+    def _create_carts(self, user_ids, popular_recipes):
+        weights = zipf_weights(len(popular_recipes))
+        cart_users = sorted(self.rng.sample(user_ids,
+                                            int(len(user_ids) * self.options['cart_share'])))
+        through = ShopList.recipes.through
+        rows = 0
+        for start in range(0, len(cart_users), self.batch_size):
+            batch = cart_users[start:start + self.batch_size]
+            shop_lists = ShopList.objects.bulk_create(ShopList(user_id=user_id) for user_id in batch)
+            links = [through(shoplist_id=shop_list.pk, recipe_id=recipe_id)
+                     for shop_list in shop_lists
+                     for recipe_id in sorted(sample_distinct(
+                         self.rng, popular_recipes, weights,
+                         self.rng.randint(1, self.options['max_cart'])))]
+            through.objects.bulk_create(links, batch_size=self.batch_size)
+            # Итоги корзины считаются в БД, как в ShopListIngredient.expected_totals
+            totals = (RecipeIngredient.objects
+                      .filter(recipe__shop_lists__user_id__in=batch)
+                      .values_list('recipe__shop_lists__user_id', 'ingredient_id')
+                      .annotate(total=Sum('amount'))
+                      .order_by())
+            created = ShopListIngredient.objects.bulk_create(
+                (ShopListIngredient(user_id=user_id, ingredient_id=ingredient_id, amount=total)
+                 for user_id, ingredient_id, total in totals if total > 0),
+                batch_size=self.batch_size)
+            rows += len(shop_lists) + len(links) + len(created)
+        return None, rows
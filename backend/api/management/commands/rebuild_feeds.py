@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from foodgram.models import FeedItem
+
+
+class Command(BaseCommand):
+    help = ('Materialize /api/recipes/feed/ for users who follow at least '
+            'FEED_FANOUT_THRESHOLD authors and switch the others back to the join. '
+            'Run periodically (e.g. from cron): users who cross the threshold '
+            'by subscribing keep reading through the join until the next run. '
+            'Use --rebuild after bulk imports, which bypass the fan-out signals.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=int,
+                            help='Defaults to the FEED_FANOUT_THRESHOLD setting')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild already materialized feeds as well')
+
+    def handle(self, *args, **options):
+        threshold = options['threshold']
+        if threshold is None:
+            threshold = settings.FEED_FANOUT_THRESHOLD
+        if threshold < 1 or options['batch_size'] < 1:
+            raise CommandError('--threshold and --batch-size must be positive')
+        started = time.perf_counter()
+        materialized, dematerialized = FeedItem.objects.sync(
+            threshold, options['batch_size'], rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Materialized {materialized} feeds ({FeedItem.objects.count()} items), '
+            f'switched {dematerialized} users back to the join '
+            f'in {time.perf_counter() - started:.1f} s'))
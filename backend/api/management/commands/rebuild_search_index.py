@@ -0,0 +1,25 @@
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodgram.models import Recipe
+from api.search import update_search_index
+
+
+class Command(BaseCommand):
+    help = ('Recompute the recipe full-text index (search_vector on PostgreSQL, '
+            'the FTS5 table on SQLite), e.g. after changing RECIPE_SEARCH_CONFIG')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        recipe_ids = Recipe.objects.order_by('pk').values_list('pk', flat=True).iterator()
+        total = 0
+        while batch := list(itertools.islice(recipe_ids, batch_size)):
+            update_search_index(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {total} recipes'))
@@ -0,0 +1,286 @@
+import io
+import json
+import re
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.urls import Resolver404, resolve
+
+from .bench_read_path import percentile
+
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+VARIABLE_RE = re.compile(r'{{(\w+)}}')
+
+
+def load_request_log(file):
+    """
+        Журнал RequestLogMiddleware: строки JSON с method и path,
+        необязательно authenticated, headers и body. Строки без
+        method/path возвращаются как None.
+    """
+    for line in file:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if not isinstance(entry, dict) or not {'method', 'path'} <= entry.keys():
+            yield None
+            continue
+        body = entry.get('body', '')
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        headers = dict(entry.get('headers', {}))
+        if body:
+            headers.setdefault('Content-Type', 'application/json')
+        yield {'method': entry['method'].upper(), 'path': entry['path'],
+               'headers': headers, 'body': body.encode(),
+               'authenticated': bool(entry.get('authenticated'))}
+
+
+def load_postman(collection, variables):
+    """
+        Запросы коллекции Postman v2.1 по порядку. Переменные {{...}}
+        берутся из коллекции и variables; запросы с неизвестными
+        переменными (их задают скрипты Postman) возвращаются как None.
+    """
+    values = {item['key']: item.get('value', '') for item in collection.get('variable', [])}
+    # Пути в журнале относительные, хост задает --target
+    values['baseUrl'] = ''
+    values.update(variables)
+
+    def substitute(text):
+        missing = set(VARIABLE_RE.findall(text)) - values.keys()
+        if missing:
+            raise KeyError(missing)
+        return VARIABLE_RE.sub(lambda match: str(values[match.group(1)]), text)
+
+    def convert(request, auth):
+        auth = request.get('auth', auth) or {}
+        url = request['url']['raw'] if isinstance(request['url'], dict) else request['url']
+        headers = {header['key']: substitute(header['value'])
+                   for header in request.get('header', []) if not header.get('disabled')}
+        authenticated = False
+        if auth.get('type') == 'apikey':
+            options = {item['key']: item['value'] for item in auth['apikey']}
+            authenticated = True
+            try:
+                headers[options.get('key', 'Authorization')] = substitute(options['value'])
+            except KeyError:
+                # Токен выдается во время прогона коллекции: подставим --token
+                pass
+        body = request.get('body') or {}
+        raw = substitute(body.get('raw', '')) if body.get('mode') == 'raw' else ''
+        if raw:
+            headers.setdefault('Content-Type', 'application/json')
+        return {'method': request['method'].upper(), 'path': substitute(url),
+                'headers': headers, 'body': raw.encode(), 'authenticated': authenticated}
+
+    def walk(items, auth):
+        for item in items:
+            item_auth = item.get('auth', auth)
+            if 'item' in item:
+                yield from walk(item['item'], item_auth)
+                continue
+            try:
+                yield convert(item['request'], item_auth)
+            except KeyError:
+                yield None
+
+    yield from walk(collection['item'], collection.get('auth'))
+
+
+def route_name(path):
+    try:
+        return resolve(urlsplit(path).path).view_name
+    except Resolver404:
+        return 'unresolved'
+
+
+class Command(BaseCommand):
+    help = ('Replay a recorded request log (JSON Lines from RequestLogMiddleware) or a '
+            'Postman collection against the in-process WSGI app or a running server '
+            'and report throughput, latency percentiles, errors and the slowest routes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Request log (.jsonl) or Postman collection (.json)')
+        parser.add_argument('--target', default='wsgi',
+                            help='"wsgi" for the in-process app or a base URL '
+                                 'such as http://localhost:8000')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Requests per second across all workers; 0 - as fast as possible')
+        parser.add_argument('--limit', type=int, help='Replay only the first N requests')
+        parser.add_argument('--token', default='',
+                            help='Token for requests recorded as authenticated')
+        parser.add_argument('--var', action='append', default=[], metavar='KEY=VALUE',
+                            help='Postman variable, e.g. --var firstRecipeId=14')
+        parser.add_argument('--include-writes', action='store_true',
+                            help='Also replay POST/PUT/PATCH/DELETE (changes the database)')
+        parser.add_argument('--slowest', type=int, default=10,
+                            help='How many routes to list by p95 latency')
+        parser.add_argument('--output', help='Write the report as JSON')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['rate'] < 0:
+            raise CommandError('--concurrency must be positive and --rate not negative')
+        if options['limit'] is not None and options['limit'] < 1:
+            raise CommandError('--limit must be positive')
+        requests, skipped = self._load(options)
+        if not requests:
+            raise CommandError(f'Nothing to replay ({sum(skipped.values())} requests skipped)')
+
+        send = (self._wsgi_sender() if options['target'] == 'wsgi'
+                else self._http_sender(options['target'].rstrip('/')))
+        results, elapsed = self._replay(requests, send, options['concurrency'], options['rate'])
+        report = self._report(results, elapsed, skipped)
+        self._print(report, options['slowest'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def _load(self, options):
+        variables = {}
+        for item in options['var']:
+            key, separator, value = item.partition('=')
+            if not separator:
+                raise CommandError(f'--var expects KEY=VALUE, got {item!r}')
+            variables[key] = value
+
+        requests = []
+        skipped = Counter()
+        with open(options['source'], encoding='utf-8') as file:
+            # Журнал читается построчно и только до --limit подходящих запросов
+            if options['source'].endswith('.jsonl'):
+                entries = load_request_log(file)
+            else:
+                entries = load_postman(json.load(file), variables)
+            for entry in entries:
+                if entry is None:
+                    skipped['unresolved'] += 1
+                    continue
+                if entry['method'] not in SAFE_METHODS and not options['include_writes']:
+                    skipped['writes'] += 1
+                    continue
+                if entry['authenticated'] and 'Authorization' not in entry['headers']:
+                    if not options['token']:
+                        skipped['no token'] += 1
+                        continue
+                    entry['headers']['Authorization'] = f'Token {options["token"]}'
+                requests.append(entry)
+                if len(requests) == options['limit']:
+                    break
+        return requests, skipped
+
+    def _wsgi_sender(self):
+        application = get_wsgi_application()
+
+        def send(request):
+            url = urlsplit(quote(request['path'], safe="/?=&%:+,;@"))
+            environ = {'REQUEST_METHOD': request['method'], 'PATH_INFO': url.path,
+                       'QUERY_STRING': url.query, 'SERVER_NAME': 'localhost',
+                       'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                       'wsgi.input': io.BytesIO(request['body']), 'wsgi.url_scheme': 'http',
+                       'CONTENT_LENGTH': str(len(request['body']))}
+            for name, value in request['headers'].items():
+                key = name.upper().replace('-', '_')
+                if key != 'CONTENT_TYPE':
+                    key = f'HTTP_{key}'
+                environ[key] = value
+            statuses = []
+            body = application(environ, lambda status, headers: statuses.append(status))
+            b''.join(body)
+            return int(statuses[0].split()[0])
+        return send
+
+    def _http_sender(self, base_url):
+        def send(request):
+            http_request = urllib.request.Request(
+                base_url + quote(request['path'], safe="/?=&%:+,;@"),
+                data=request['body'] or None, method=request['method'],
+                headers=request['headers'])
+            try:
+                with urllib.request.urlopen(http_request, timeout=30) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as error:
+                return error.code
+        return send
+
+    def _replay(self, requests, send, concurrency, rate):
+        lock = threading.Lock()
+        started = time.perf_counter()
+        next_slot = started
+
+        def call(request):
+            nonlocal next_slot
+            if rate:
+                # Общее расписание на все потоки: не больше rate запросов в секунду
+                with lock:
+                    slot = next_slot
+                    next_slot += 1 / rate
+                delay = slot - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                status = send(request)
+            except OSError:
+                status = None
+            return route_name(request['path']), status, time.perf_counter() - sent
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(call, requests))
+        return results, time.perf_counter() - started
+
+    def _report(self, results, elapsed, skipped):
+        latencies = [latency for _, _, latency in results]
+        statuses = Counter('failed' if status is None else f'{status // 100}xx'
+                           for _, status, _ in results)
+        # Ошибки - ответы 5xx и сбои соединения; 4xx ожидаемы в коллекции
+        errors = statuses['5xx'] + statuses['failed']
+        by_route = defaultdict(list)
+        for route, status, latency in results:
+            by_route[route].append((status, latency))
+        routes = {
+            route: {
+                'requests': len(items),
+                'p50_ms': round(statistics.median(latency for _, latency in items) * 1000, 2),
+                'p95_ms': round(percentile([latency for _, latency in items], 95) * 1000, 2),
+                'errors': sum(status is None or status >= 500 for status, _ in items),
+            }
+            for route, items in by_route.items()
+        }
+        return {
+            'requests': len(results),
+            'skipped': dict(skipped),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(results) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2),
+            'statuses': dict(statuses),
+            'error_rate': round(errors / len(results), 4),
+            'routes': dict(sorted(routes.items(), key=lambda item: -item[1]['p95_ms'])),
+        }
+
+    def _print(self, report, slowest):
+        skipped = ', '.join(f'{reason} {count}' for reason, count in report['skipped'].items())
+        self.stdout.write(
+            f'{report["requests"]} requests in {report["elapsed_s"]} s '
+            f'({report["throughput_rps"]} req/s), skipped: {skipped or "none"}\n'
+            f'latency p50 {report["p50_ms"]} ms, p95 {report["p95_ms"]} ms, '
+            f'p99 {report["p99_ms"]} ms, max {report["max_ms"]} ms\n'
+            f'statuses {report["statuses"]}, error rate {report["error_rate"]:.2%}')
+        self.stdout.write(f'{"slowest routes":<40}{"requests":>9}{"p50 ms":>9}'
+                          f'{"p95 ms":>9}{"errors":>8}')
+        for route, row in list(report['routes'].items())[:slowest]:
+            self.stdout.write(f'{route:<40}{row["requests"]:>9}{row["p50_ms"]:>9}'
+                              f'{row["p95_ms"]:>9}{row["errors"]:>8}')
@@ -0,0 +1,102 @@
+import math
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from foodgram.models import RecipeEvent, TrendingRecipe, TrendingScore
+
+# Начало отсчета для логарифмов рейтинга; менять нельзя без пересчета
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+# Рецепты, чей затухший рейтинг ниже порога, удаляются из таблицы рейтингов
+MIN_SCORE = 0.01
+
+
+def decay_rate():
+    """Затухание в единицах ln на секунду"""
+    return math.log(2) / (settings.TRENDING_HALF_LIFE_HOURS * 3600)
+
+
+def log_sum_exp(values):
+    top = max(values)
+    return top + math.log(sum(math.exp(value - top) for value in values))
+
+
+class Command(BaseCommand):
+    help = ('Fold new favorite/cart events into time-decayed recipe scores and '
+            'store the top-K snapshot served by /api/recipes/trending/. Run periodically.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        started = time.perf_counter()
+        rate = decay_rate()
+        now = timezone.now()
+        weights = {kind: math.log(weight)
+                   for kind, weight in settings.TRENDING_WEIGHTS.items() if weight > 0}
+
+        with transaction.atomic():
+            # События, пришедшие во время расчета, достанутся следующему запуску
+            last_id = RecipeEvent.objects.aggregate(last=Max('id'))['last'] or 0
+            events = RecipeEvent.objects.filter(id__lte=last_id)
+            terms = defaultdict(list)
+            # Событие с меньшим id может закоммититься уже после чтения:
+            # удаляются только учтенные строки, а не весь диапазон id
+            processed_ids = []
+            for event_id, recipe_id, kind, created_at in (
+                    events
+                    .values_list('pk', 'recipe_id', 'kind', 'created_at')
+                    .iterator(chunk_size=batch_size)):
+                processed_ids.append(event_id)
+                if kind in weights:
+                    terms[recipe_id].append(
+                        weights[kind] + rate * (created_at - EPOCH).total_seconds())
+            self._fold(terms, batch_size)
+            for start in range(0, len(processed_ids), batch_size):
+                RecipeEvent.objects.filter(
+                    pk__in=processed_ids[start:start + batch_size]).delete()
+            processed = len(processed_ids)
+
+            floor = rate * (now - EPOCH).total_seconds()
+            pruned, _ = TrendingScore.objects.filter(
+                log_score__lt=floor + math.log(MIN_SCORE)).delete()
+            top = (TrendingScore.objects
+                   .order_by('-log_score', 'recipe_id')
+                   .values_list('recipe_id', 'log_score')[:settings.TRENDING_SIZE])
+            TrendingRecipe.objects.all().delete()
+            snapshot = TrendingRecipe.objects.bulk_create(
+                TrendingRecipe(position=position, recipe_id=recipe_id,
+                               score=math.exp(log_score - floor), computed_at=now)
+                for position, (recipe_id, log_score) in enumerate(top, 1))
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} events for {len(terms)} recipes, pruned {pruned} '
+            f'faded scores, snapshot of {len(snapshot)} recipes '
+            f'in {(time.perf_counter() - started) * 1000:.0f} ms'))
+
+    def _fold(self, terms, batch_size):
+        """Прибавляет новые события к накопленным рейтингам"""
+        recipe_ids = list(terms)
+        for start in range(0, len(recipe_ids), batch_size):
+            batch = recipe_ids[start:start + batch_size]
+            existing = {score.recipe_id: score
+                        for score in TrendingScore.objects.filter(recipe_id__in=batch)}
+            to_create, to_update = [], []
+            for recipe_id in batch:
+                score = existing.get(recipe_id)
+                if score is None:
+                    to_create.append(TrendingScore(recipe_id=recipe_id,
+                                                   log_score=log_sum_exp(terms[recipe_id])))
+                else:
+                    score.log_score = log_sum_exp(terms[recipe_id] + [score.log_score])
+                    to_update.append(score)
+            TrendingScore.objects.bulk_create(to_create)
+            TrendingScore.objects.bulk_update(to_update, ['log_score'])
@@ -0,0 +1,133 @@
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_route_stats = {}
+_route_stats_lock = threading.Lock()
+
+
+class QueryCounter:
+    """Обертка над выполнением SQL: считает запросы и время в БД"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+    @property
+    def duration_ms(self):
+        return self.duration * 1000
+
+
+def get_route_name(request):
+    """Имя маршрута вида foodgram_api:recipe-list"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    return match.view_name
+
+
+def get_query_budget(route):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(route)
+
+
+def get_route_stats():
+    """Накопленная статистика по маршрутам текущего процесса"""
+    with _route_stats_lock:
+        return {route: dict(stats) for route, stats in _route_stats.items()}
+
+
+def reset_route_stats():
+    with _route_stats_lock:
+        _route_stats.clear()
+
+
+def _record(route, counter, over_budget):
+    with _route_stats_lock:
+        stats = _route_stats.setdefault(route, {'requests': 0,
+                                                'queries': 0,
+                                                'max_queries': 0,
+                                                'db_time_ms': 0.0,
+                                                'over_budget': 0})
+        stats['requests'] += 1
+        stats['queries'] += counter.count
+        stats['max_queries'] = max(stats['max_queries'], counter.count)
+        stats['db_time_ms'] += counter.duration_ms
+        stats['over_budget'] += int(over_budget)
+
+
+class QueryBudgetMiddleware:
+    """
+        Учет SQL-запросов и времени БД для каждого запроса,
+        сгруппированный по маршруту. Предупреждает в лог, если маршрут
+        превысил бюджет из settings.QUERY_BUDGETS или
+        settings.QUERY_BUDGET_DB_TIME_MS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+
+        route = get_route_name(request)
+        if route is None:
+            return response
+        budget = get_query_budget(route)
+        time_budget = getattr(settings, 'QUERY_BUDGET_DB_TIME_MS', None)
+        over_budget = ((budget is not None and counter.count > budget)
+                       or (time_budget is not None
+                           and counter.duration_ms > time_budget))
+        _record(route, counter, over_budget)
+        if over_budget:
+            logger.warning('Маршрут %s превысил бюджет: %s SQL-запросов '
+                           '(лимит %s), %.1f мс в БД',
+                           route, counter.count, budget,
+                           counter.duration_ms)
+        return response
+
+
+class RequestLogMiddleware:
+    """
+        Дописывает каждый запрос строкой JSON в settings.REQUEST_LOG_PATH:
+        журнал для replay_traffic. Токен и тело запроса не сохраняются,
+        вместо токена - признак authenticated.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        started = time.time()
+        response = self.get_response(request)
+        line = json.dumps({
+            'time': round(started, 3),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'authenticated': 'Authorization' in request.headers,
+            'status': response.status_code,
+            'duration_ms': round((time.time() - started) * 1000, 1),
+            'route': get_route_name(request),
+        }, ensure_ascii=False)
+        with self.lock, open(settings.REQUEST_LOG_PATH, 'a', encoding='utf-8') as file:
+            file.write(line + '\n')
+        return response
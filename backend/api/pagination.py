@@ -1,6 +1,206 @@
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPaginator:
+    """
+        Постраничный вывод по ключу (created_at, id): следующая страница
+        выбирается условием WHERE по последней записи, без COUNT и OFFSET,
+        поэтому глубокие страницы не медленнее первой.
+    """
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self, ordering, page_size):
+        self.ordering = ordering
+        self.page_size = page_size
+
+    @staticmethod
+    def _split(field):
+        return field.lstrip('-'), field.startswith('-')
+
+    def encode_cursor(self, instance):
+        values = [getattr(instance, self._split(field)[0])
+                  for field in self.ordering]
+        # isoformat сохраняет микросекунды, без них ключ неоднозначен
+        data = json.dumps(values, default=lambda value: value.isoformat())
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def _output_field(self, queryset, name):
+        # Ключом может быть и аннотация, например дата записи ленты
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, queryset, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [self._output_field(queryset, self._split(field)[0]).to_python(value)
+                    for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, values):
+        """Условие 'строго после курсора' для составного ключа"""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name, descending = self._split(field)
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return condition
+
+    def paginate(self, queryset, cursor):
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            values = self.decode_cursor(queryset, cursor)
+            queryset = queryset.filter(self.after(values))
+        page = list(queryset[:self.page_size + 1])
+        has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        next_cursor = self.encode_cursor(page[-1]) if has_next else None
+        return page, next_cursor
 
 
 class CustomPagination(PageNumberPagination):
+    """
+        Номерная пагинация для фронтенда. Если в запросе есть параметр
+        cursor (пустой - первая страница), выдача идет по ключу
+        из view.cursor_ordering и ответ содержит только next и results.
+    """
     page_size_query_param = 'limit'
     page_size = 5
+    max_page_size = settings.PAGINATION_MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-created_at', '-id')
+    cursor_only = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if not self.cursor_only and self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        ordering = getattr(view, 'cursor_ordering', self.cursor_ordering)
+        self.keyset = KeysetPaginator(ordering, self.get_page_size(request))
+        page, self.next_cursor = self.keyset.paginate(
+            queryset, request.query_params.get(self.cursor_query_param, ''))
+        return page
+
+    def get_next_link(self):
+        if self.keyset is None:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param,
+                                   self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if self.keyset is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class KeysetPagination(CustomPagination):
+    """Только выдача по ключу: для лент, где номер страницы не нужен"""
+    cursor_only = True
+
+
+COUNT_VERSION_KEY = 'pagination:count-version'
+
+
+def bump_count_version():
+    """Сбрасывает все закэшированные count (вызывается сигналами)"""
+    try:
+        cache.incr(COUNT_VERSION_KEY)
+    except ValueError:
+        cache.set(COUNT_VERSION_KEY, 1, timeout=None)
+
+
+class CachedCountPaginator(DjangoPaginator):
+    """
+        Paginator, который кэширует count для каждого SQL-запроса
+        (то есть для каждой комбинации фильтров) на
+        PAGINATION_COUNT_CACHE_TTL секунд. На PostgreSQL, если оценка
+        планировщика больше PAGINATION_COUNT_ESTIMATE_THRESHOLD,
+        вместо COUNT(*) отдается оценка.
+    """
+    count_is_estimated = False
+
+    def _cache_key(self):
+        query = self.object_list.query
+        sql, params = query.sql_with_params()
+        digest = hashlib.md5(
+            f'{query.model._meta.label}:{sql}:{params!r}'.encode()
+        ).hexdigest()
+        version = cache.get(COUNT_VERSION_KEY, 0)
+        return f'pagination:count:{version}:{digest}'
+
+    def _estimate_count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    @cached_property
+    def count(self):
+        try:
+            key = self._cache_key()
+        except EmptyResultSet:
+            # queryset.none(): SQL не строится и считать нечего
+            return 0
+        cached = cache.get(key)
+        if cached is not None:
+            self.count_is_estimated = cached['estimated']
+            return cached['count']
+
+        count = self._estimate_count()
+        threshold = settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+        if count is not None and count > threshold:
+            self.count_is_estimated = True
+        else:
+            count = super().count
+        cache.set(key,
+                  {'count': count, 'estimated': self.count_is_estimated},
+                  settings.PAGINATION_COUNT_CACHE_TTL)
+        return count
+
+
+class CachedCountPagination(CustomPagination):
+    """Пагинация с кэшированным или оценочным count"""
+    django_paginator_class = CachedCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.keyset is None:
+            response.data['count_is_estimated'] = (
+                self.page.paginator.count_is_estimated)
+        return response
@@ -0,0 +1,96 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from .conditional import last_modified
+
+HITS_KEY = 'response-cache:hits'
+MISSES_KEY = 'response-cache:misses'
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _incr(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_stats():
+    """Счетчики попаданий и промахов кэша ответов"""
+    stats = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits = stats.get(HITS_KEY, 0)
+    misses = stats.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None}
+
+
+def cache_key(request, scopes, renderer_format):
+    stamps = last_modified(scopes)
+    # Ссылки на картинки в ответе абсолютные и зависят от хоста
+    digest = hashlib.md5(
+        f'{request.get_host()}:{request.get_full_path()}:{renderer_format}:{stamps}'.encode()
+    ).hexdigest()
+    return f'response-cache:{digest}'
+
+
+def get_response(key):
+    """Готовый ответ из кэша или None (с учетом в счетчиках)"""
+    cached = get_cache().get(key)
+    if cached is None:
+        _incr(MISSES_KEY)
+        return None
+    _incr(HITS_KEY)
+    content, content_type = cached
+    response = HttpResponse(content, content_type=content_type)
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def store_response(key, response):
+    """Кладет ответ 200 в кэш, как только он будет отрендерен"""
+    response['X-Cache'] = 'MISS'
+    if response.status_code != 200:
+        return response
+
+    def store(rendered):
+        get_cache().set(key, (rendered.content, rendered['Content-Type']),
+                        settings.RESPONSE_CACHE_TTL)
+    if hasattr(response, 'add_post_render_callback'):
+        response.add_post_render_callback(store)
+    else:
+        store(response)
+    return response
+
+
+def cache_anonymous_response(scopes):
+    """
+        Кэширует готовые ответы GET для анонимных пользователей по пути,
+        параметрам запроса и формату ответа. В ключ входят отметки
+        изменений областей (scopes(view, kwargs)), поэтому сигналы
+        изменения данных делают старые записи недоступными.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.user.is_authenticated or request.method != 'GET':
+                return method(view, request, *args, **kwargs)
+
+            renderer = getattr(request, 'accepted_renderer', None)
+            key = cache_key(request, scopes(view, kwargs), getattr(renderer, 'format', ''))
+            response = get_response(key)
+            if response is not None:
+                return response
+            return store_response(key, method(view, request, *args, **kwargs))
+        return wrapper
+    return decorator
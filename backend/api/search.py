@@ -0,0 +1,103 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Aggregate, Case, F, OuterRef, Subquery, TextField, Value, When
+from django.db.models.functions import Coalesce
+
+from foodgram.models import Recipe, RecipeIngredient
+
+FTS_TABLE = 'foodgram_recipe_fts'
+TERM_RE = re.compile(r'\w+')
+
+
+class StringAgg(Aggregate):
+    # django.contrib.postgres.aggregates тянет psycopg даже на SQLite
+    function = 'STRING_AGG'
+    output_field = TextField()
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def _postgres_vector():
+    config = settings.RECIPE_SEARCH_CONFIG
+    ingredients = (RecipeIngredient.objects
+                   .filter(recipe=OuterRef('pk'))
+                   .values('recipe')
+                   .annotate(names=StringAgg('ingredient__name', Value(' ')))
+                   .values('names'))
+    return (SearchVector('name', weight='A', config=config)
+            + SearchVector(Coalesce(Subquery(ingredients), Value(''),
+                                    output_field=TextField()),
+                           weight='B', config=config)
+            + SearchVector('text', weight='C', config=config))
+
+
+def _update_sqlite_index(recipe_ids):
+    rows = {pk: [name, text, []] for pk, name, text in
+            Recipe.objects.filter(pk__in=recipe_ids).values_list('pk', 'name', 'text')}
+    for recipe_id, name in (RecipeIngredient.objects
+                            .filter(recipe_id__in=rows)
+                            .values_list('recipe_id', 'ingredient__name')):
+        rows[recipe_id][2].append(name)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [(pk,) for pk in recipe_ids])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+            f'VALUES (%s, %s, %s, %s)',
+            [(pk, name, text, ' '.join(ingredients))
+             for pk, (name, text, ingredients) in rows.items()])
+
+
+def update_search_index(recipe_ids):
+    """
+        Пересчитывает поисковый индекс рецептов: search_vector на
+        PostgreSQL или строки FTS5-таблицы на SQLite.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    if is_postgresql():
+        Recipe.objects.filter(pk__in=recipe_ids).update(search_vector=_postgres_vector())
+    elif connection.vendor == 'sqlite':
+        _update_sqlite_index(recipe_ids)
+
+
+def _fts_query(search):
+    # Каждое слово - префиксный терм, слова объединяются через AND
+    terms = TERM_RE.findall(search)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_recipes(queryset, search):
+    """Фильтрует рецепты по поисковой строке и сортирует по релевантности"""
+    if is_postgresql():
+        query = SearchQuery(search, config=settings.RECIPE_SEARCH_CONFIG,
+                            search_type='websearch')
+        return (queryset
+                .filter(search_vector=query)
+                .annotate(rank=SearchRank(F('search_vector'), query))
+                .order_by('-rank', '-created_at'))
+
+    if connection.vendor != 'sqlite':
+        return queryset.filter(name__icontains=search)
+
+    fts_query = _fts_query(search)
+    if not fts_query:
+        return queryset.none()
+    with connection.cursor() as cursor:
+        # bm25 тем меньше, чем документ релевантнее; веса: name, text, ingredients
+        cursor.execute(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                       f'ORDER BY bm25({FTS_TABLE}, 10.0, 1.0, 5.0) LIMIT %s',
+                       [fts_query, settings.RECIPE_SEARCH_MAX_RESULTS])
+        ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        return queryset.none()
+    return (queryset
+            .filter(pk__in=ids)
+            .order_by(Case(*(When(pk=pk, then=Value(position))
+                             for position, pk in enumerate(ids)))))
@@ -1,6 +1,7 @@
 import logging
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, PasswordSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework.fields import SerializerMethodField, CharField
@@ -9,16 +10,33 @@ from rest_framework.serializers import (ModelSerializer,
                                         IntegerField,
                                         ValidationError)
 
-from foodgram.models import Subscription, Ingredient, Recipe, RecipeIngredient, Favorite, ShopList
+from foodgram.models import (Subscription, Ingredient, Recipe, RecipeIngredient, Favorite, ShopList,
+                             ShopListIngredient)
+from .signals import recipe_ingredients_changed, touch_recipes
+from .uploads import ImageUploadField, json_form_fields
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
+def variant_urls(request, field_file, variants):
+    """Абсолютные адреса вариантов картинки, если они построены по текущему файлу"""
+    if not field_file or variants.get('source') != field_file.name:
+        return {}
+    urls = {}
+    for variant, name in variants.items():
+        if variant == 'source':
+            continue
+        url = field_file.storage.url(name)
+        urls[variant] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
 class CustomUserSerializer(UserCreateSerializer):
     """Кастомный сериализатор пользователя"""
     is_subscribed = SerializerMethodField()
     avatar = Base64ImageField(max_length=25500, required=False)
+    avatar_variants = SerializerMethodField()
 
     class Meta:
         model = User
@@ -26,10 +44,14 @@ class CustomUserSerializer(UserCreateSerializer):
                   tuple(User.REQUIRED_FIELDS)) + (
                      'is_subscribed',
                      'avatar',
+                     'avatar_variants',
                  )
         read_only_fields = ['is_subscribed', 'id']
 
     def get_is_subscribed(self, obj):
+        # Значение могло быть посчитано в запросе (аннотация)
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         user = request.user
         if user.is_authenticated:
@@ -37,6 +59,9 @@ class CustomUserSerializer(UserCreateSerializer):
                 return True
         return False
 
+    def get_avatar_variants(self, obj):
+        return variant_urls(self.context.get('request'), obj.avatar, obj.avatar_variants)
+
     def to_representation(self, instance):
         # переопределим метод, чтобы нужные вещи выводились
         representation = super().to_representation(instance)
@@ -52,6 +77,7 @@ class CustomUserSerializer(UserCreateSerializer):
         if request.path == '/api/users/' and request.method == "POST":
             representation.pop('is_subscribed', None)
             representation.pop('avatar', None)
+            representation.pop('avatar_variants', None)
 
         return representation
 
@@ -85,7 +111,7 @@ class CustomUserSerializer(UserCreateSerializer):
 
 class AvatarSerializer(ModelSerializer):
     """Сериализатор для аватара"""
-    avatar = Base64ImageField(max_length=25500, required=True)
+    avatar = ImageUploadField(max_length=25500, required=True)
 
     class Meta:
         model = User
@@ -130,8 +156,9 @@ class RecipeSerializer(ModelSerializer):
     is_favorited = SerializerMethodField(read_only=True)
     is_in_shopping_cart = SerializerMethodField(read_only=True)
     author = CustomUserSerializer(read_only=True)
-    image = Base64ImageField(max_length=10 ** 6,
+    image = ImageUploadField(max_length=10 ** 6,
                              required=True)
+    image_variants = SerializerMethodField()
     cooking_time = IntegerField(required=True)
     text = CharField(required=True)
 
@@ -144,6 +171,8 @@ class RecipeSerializer(ModelSerializer):
                   'is_in_shopping_cart',
                   'name',
                   'image',
+                  'image_variants',
+                  'favorites_count',
                   'text',
                   'cooking_time')
 
@@ -176,7 +205,25 @@ class RecipeSerializer(ModelSerializer):
             raise ValidationError(
                 'Время готовки должно быть больше либо равно 1')
 
+    def to_representation(self, instance):
+        # Подписка на автора посчитана в запросе рецептов,
+        # передаем ее сериализатору автора
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        representation = super().to_representation(instance)
+        # В списке карточкам достаточно уменьшенной копии
+        image_variant = self.context.get('image_variant')
+        variants = representation.get('image_variants') or {}
+        if image_variant in variants and 'image' in representation:
+            representation['image'] = variants[image_variant]
+        return representation
+
+    def get_image_variants(self, obj):
+        return variant_urls(self.context.get('request'), obj.image, obj.image_variants)
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         user = request.user
         if user.is_authenticated:
@@ -188,6 +235,8 @@ class RecipeSerializer(ModelSerializer):
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         user = request.user
         if user.is_authenticated:
@@ -215,6 +264,7 @@ class RecipeUserSerializer(CustomUserSerializer):
                      'recipes',
                      'recipes_count',
                      'avatar',
+                     'avatar_variants',
                  )
         read_only_fields = ['is_subscribed',
                             'id',
@@ -223,8 +273,14 @@ class RecipeUserSerializer(CustomUserSerializer):
                             'recipes_count']
 
     def get_recipes(self, obj):
-        limit = self.context.get('request').query_params.get('recipes_limit', obj.recipes.count())
-        recipes = obj.recipes.all()[:int(limit)]
+        # Превью могли загрузить заранее одним запросом (ROW_NUMBER по автору)
+        if hasattr(obj, 'recipe_preview'):
+            recipes = obj.recipe_preview
+        else:
+            limit = self.context.get('request').query_params.get('recipes_limit', '')
+            recipes = obj.recipes.all()
+            if limit.isdigit():
+                recipes = recipes[:int(limit)]
         return RecipeSerializer(recipes,
                                 exclude_text=True,
                                 exclude_ingredients=True,
@@ -233,6 +289,8 @@ class RecipeUserSerializer(CustomUserSerializer):
                                 many=True).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
 
@@ -277,41 +335,86 @@ class PostRecipeSerializer(RecipeSerializer):
                   'cooking_time',
                   'name',
                   'image',
+                  'image_variants',
+                  'favorites_count',
                   'text',
                   'cooking_time'
                   )
         read_only_fields = ['author']
 
     def create_ingredients_connections(self, recipe, ingredients):
-        print(ingredients)
-        for ingredient in ingredients:
-            ing_id = ingredient.get('id')
-            print(ing_id)
-            ingredient_inst = Ingredient.objects.get(id=ing_id)
-            RecipeIngredient.objects.create(recipe=recipe,
-                                            ingredient=ingredient_inst,
-                                            amount=ingredient.get('amount'))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe,
+                             ingredient_id=ingredient.get('id'),
+                             amount=ingredient.get('amount'))
+            for ingredient in ingredients)
+        # bulk_create не посылает post_save
+        recipe_ingredients_changed([recipe.pk])
 
     def create(self, validated_data):
         ingredients = validated_data.pop('recipeingredient_set')
         user = self.context.get('request').user
-        recipe = Recipe.objects.create(**validated_data, author=user)
-        self.create_ingredients_connections(recipe, ingredients)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data, author=user)
+            self.create_ingredients_connections(recipe, ingredients)
         return recipe
 
+    def update_ingredients_connections(self, recipe, ingredients):
+        """
+            Приводит состав рецепта к ingredients, меняя только отличающиеся
+            строки. Возвращает изменения количеств {ingredient_id: разница}.
+        """
+        submitted = {ingredient['id']: ingredient['amount'] for ingredient in ingredients}
+        old_amounts = {}
+        kept = set()
+        to_update = []
+        to_delete = []
+        for row in RecipeIngredient.objects.filter(recipe=recipe).order_by('pk'):
+            old_amounts[row.ingredient_id] = old_amounts.get(row.ingredient_id, 0) + row.amount
+            # Повторы одного ингредиента в старых рецептах тоже удаляются
+            if row.ingredient_id not in submitted or row.ingredient_id in kept:
+                to_delete.append(row.pk)
+                continue
+            kept.add(row.ingredient_id)
+            if row.amount != submitted[row.ingredient_id]:
+                row.amount = submitted[row.ingredient_id]
+                to_update.append(row)
+        to_create = [RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id, amount=amount)
+                     for ingredient_id, amount in submitted.items() if ingredient_id not in kept]
+        if not (to_create or to_update or to_delete):
+            return {}
+
+        RecipeIngredient.objects.filter(pk__in=to_delete).delete()
+        RecipeIngredient.objects.bulk_update(to_update, ['amount'])
+        RecipeIngredient.objects.bulk_create(to_create)
+        if to_create or to_delete:
+            recipe_ingredients_changed([recipe.pk])
+        else:
+            # Количества не входят в поисковый индекс
+            touch_recipes([recipe.pk])
+        return {ingredient_id: submitted.get(ingredient_id, 0) - old_amounts.get(ingredient_id, 0)
+                for ingredient_id in old_amounts.keys() | submitted.keys()}
+
     def update(self, instance, validated_data):
         if validated_data.get('recipeingredient_set', None) is not None:
             ingredients = validated_data.pop('recipeingredient_set')
-            instance.ingredients.clear()
-            self.create_ingredients_connections(instance, ingredients)
-            return super().update(instance, validated_data)
+            with transaction.atomic():
+                deltas = self.update_ingredients_connections(instance, ingredients)
+                self.update_shop_list_totals(instance, deltas)
+                return super().update(instance, validated_data)
         raise ValidationError({'ingredients': 'Это поле обязательно.'})
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['ingredients'] = _IngredientSerializer(instance.recipeingredient_set.all(),
-                                                              many=True).data
-        return representation
+    def update_shop_list_totals(self, recipe, deltas):
+        """Переносит изменение состава рецепта в итоги корзин, где он лежит"""
+        if not any(deltas.values()):
+            return
+        user_ids = list(recipe.shop_lists.values_list('user_id', flat=True))
+        if user_ids:
+            ShopListIngredient.objects.apply_deltas(user_ids, deltas)
+
+    def to_internal_value(self, data):
+        # В multipart-форме ингредиенты приходят JSON-строкой
+        return super().to_internal_value(json_form_fields(data, ('ingredients',)))
 
     def validate_ingredients(self, value):
         if value:
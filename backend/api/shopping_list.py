@@ -0,0 +1,58 @@
+import csv
+import json
+
+from django.db.models import Sum
+
+from foodgram.models import ShopListIngredient
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def get_shopping_list(user):
+    """
+        Список покупок из заранее посчитанных итогов корзины.
+        Группировка по названию и единице склеивает дубли каталога.
+    """
+    return (ShopListIngredient.objects
+            .filter(user=user)
+            .values_list('ingredient__name', 'ingredient__measurement_unit')
+            .annotate(total=Sum('amount'))
+            .order_by('ingredient__name', 'ingredient__measurement_unit'))
+
+
+def render_txt(rows):
+    separator = ''
+    for name, unit, amount in rows:
+        yield f'{separator}{name} {unit}: {amount}'
+        separator = '\n'
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_json(rows):
+    yield '['
+    separator = ''
+    for name, unit, amount in rows:
+        item = json.dumps({'name': name,
+                           'measurement_unit': unit,
+                           'amount': amount}, ensure_ascii=False)
+        yield f'{separator}{item}'
+        separator = ','
+    yield ']'
+
+
+FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'json': (render_json, 'application/json'),
+}
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from foodgram.models import ShortLink, hashids
+from .conditional import last_modified, recipe_scope
+
+
+def decode(hashid):
+    """
+        id рецепта из короткой ссылки без обращения к БД.
+        Неканоничные строки (другая соль, лишние числа) дают None.
+    """
+    ids = hashids.decode(hashid)
+    if len(ids) == 1 and hashids.encode(ids[0]) == hashid:
+        return ids[0]
+    return None
+
+
+def resolve(hashid):
+    """id рецепта по короткой ссылке; таблица ShortLink - только запасной путь"""
+    recipe_id = decode(hashid)
+    if recipe_id is None:
+        recipe_id = (ShortLink.objects
+                     .filter(hashid=hashid)
+                     .values_list('recipe_id', flat=True)
+                     .first())
+    return recipe_id
+
+
+async def aresolve(hashid):
+    recipe_id = decode(hashid)
+    if recipe_id is None:
+        recipe_id = await (ShortLink.objects
+                           .filter(hashid=hashid)
+                           .values_list('recipe_id', flat=True)
+                           .afirst())
+    return recipe_id
+
+
+class PayloadCache:
+    """
+        LRU готовых данных рецептов в памяти процесса. Запись действительна,
+        пока не изменилась отметка области рецепта (conditional.touch),
+        поэтому правки из других процессов тоже сбрасывают ее.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key, stamp):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != stamp:
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, stamp, payload):
+        with self._lock:
+            self._items[key] = (stamp, payload)
+            self._items.move_to_end(key)
+            while len(self._items) > settings.SHORT_LINK_CACHE_SIZE:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+payloads = PayloadCache()
+
+
+def get_payload(request, hashid, load):
+    """
+        Данные рецепта по короткой ссылке для анонимного читателя.
+        load(recipe_id) возвращает данные или None, если рецепта нет.
+    """
+    recipe_id = resolve(hashid)
+    if recipe_id is None:
+        return None
+    # Отметку читаем до загрузки: правка во время загрузки не останется в кэше
+    stamp = last_modified([recipe_scope(recipe_id)])[0]
+    # Адреса картинок в данных абсолютные и зависят от хоста
+    key = (request.get_host(), recipe_id)
+    payload = payloads.get(key, stamp)
+    if payload is None:
+        payload = load(recipe_id)
+        if payload is not None:
+            payloads.set(key, stamp, payload)
+    return payload
+
+
+async def aget_payload(request, hashid, load):
+    """То же, что get_payload, для async-вьюх: load - корутина"""
+    recipe_id = await aresolve(hashid)
+    if recipe_id is None:
+        return None
+    stamp = last_modified([recipe_scope(recipe_id)])[0]
+    key = (request.get_host(), recipe_id)
+    payload = payloads.get(key, stamp)
+    if payload is None:
+        payload = await load(recipe_id)
+        if payload is not None:
+            payloads.set(key, stamp, payload)
+    return payload
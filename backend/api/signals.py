@@ -0,0 +1,308 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.db.models import F
+from django.dispatch import receiver
+
+from foodgram.images import refresh_variants
+from foodgram.models import (Favorite, FeedItem, Ingredient, Recipe, RecipeEvent,
+                             RecipeIngredient, ShopList, ShopListIngredient, Subscription,
+                             User)
+from foodgram.signals import ingredients_bulk_changed, recipes_bulk_changed
+from .conditional import INGREDIENTS, RECIPES, recipe_scope, touch, viewer_scope
+from .ingredient_index import ingredient_index
+from .pagination import bump_count_version
+from .search import update_search_index
+
+# Поля пользователя, которые попадают в выдачу рецептов
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name', 'avatar')
+
+logger = logging.getLogger(__name__)
+
+
+# Pillow работает после фиксации транзакции и только при смене файла:
+# вход в систему или смена пароля сохраняют пользователя без картинки
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def refresh_image_variants(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if sender is Recipe:
+        field, variants_field, sizes = 'image', 'image_variants', settings.IMAGE_VARIANTS['recipes']
+    else:
+        field, variants_field, sizes = 'avatar', 'avatar_variants', settings.IMAGE_VARIANTS['avatars']
+    if update_fields is not None and field not in update_fields:
+        return
+    current = getattr(instance, variants_field) or {}
+    if current.get('source', '') == (getattr(instance, field).name or ''):
+        return
+
+    def refresh():
+        try:
+            changed = refresh_variants(instance, field, variants_field, sizes)
+        except (OSError, ValueError):
+            # Без вариантов отдается оригинал, их досоздаст backfill_image_variants
+            logger.warning('Не удалось создать варианты %s для %s %s',
+                           field, sender.__name__, instance.pk, exc_info=True)
+            return
+        if not changed:
+            return
+        if sender is Recipe:
+            touch_recipes([instance.pk])
+        else:
+            touch_recipes(Recipe.objects.filter(author_id=instance.pk).values_list('pk', flat=True))
+    transaction.on_commit(refresh)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def reset_recipe_counts(sender, **kwargs):
+    bump_count_version()
+
+
+# Счетчик избранного меняется в БД через F(), без гонок между запросами.
+# Он входит в выдачу рецепта, поэтому рецепт помечается измененным.
+@receiver(post_save, sender=Favorite)
+def increment_favorites_count(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        favorites_count=F('favorites_count') + 1)
+    touch_recipes([instance.recipe_id])
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorites_count(sender, instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id, favorites_count__gt=0).update(
+        favorites_count=F('favorites_count') - 1)
+    touch_recipes([instance.recipe_id])
+
+
+# События для рейтинга популярных рецептов (update_trending)
+@receiver(post_save, sender=Favorite)
+def record_favorite_event(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        RecipeEvent.objects.create(recipe_id=instance.recipe_id, kind=RecipeEvent.FAVORITE)
+
+
+@receiver(m2m_changed, sender=ShopList.recipes.through)
+def record_cart_events(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    recipe_ids = [instance.pk] * len(pk_set) if reverse else pk_set
+    RecipeEvent.objects.bulk_create(RecipeEvent(recipe_id=recipe_id, kind=RecipeEvent.CART)
+                                    for recipe_id in recipe_ids)
+
+
+@receiver(m2m_changed, sender=ShopList.recipes.through)
+def reset_shop_list_counts(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_count_version()
+
+
+@receiver(m2m_changed, sender=ShopList.recipes.through)
+def update_shop_list_totals(sender, instance, action, reverse, pk_set, **kwargs):
+    """Пересчет итогов корзины при добавлении и удалении рецептов"""
+    if action == 'pre_clear':
+        related = instance.shop_lists if reverse else instance.recipes
+        instance._cleared_pks = set(related.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if not pk_set:
+        return
+
+    sign = 1 if action == 'post_add' else -1
+    if reverse:
+        user_ids = ShopList.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)
+        recipe_ids = [instance.pk]
+    else:
+        user_ids = [instance.user_id]
+        recipe_ids = pk_set
+    amounts = ShopListIngredient.objects.recipe_amounts(recipe_ids)
+    ShopListIngredient.objects.apply_deltas(
+        user_ids, {ingredient_id: sign * amount for ingredient_id, amount in amounts.items()})
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_deleted_recipe_from_totals(sender, instance, **kwargs):
+    # Каскадное удаление строк корзины не посылает m2m_changed
+    user_ids = instance.shop_lists.values_list('user_id', flat=True)
+    amounts = ShopListIngredient.objects.recipe_amounts([instance.pk])
+    ShopListIngredient.objects.apply_deltas(
+        user_ids, {ingredient_id: -amount for ingredient_id, amount in amounts.items()})
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    # Как и touch(): версия меняется после коммита, иначе параллельный запрос
+    # успеет собрать индекс из старых строк под новой версией
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_recipe_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    update_search_index([instance.pk])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def update_recipe_ingredient_search(sender, instance, **kwargs):
+    update_search_index([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_recipe_ingredients_search(sender, instance, action, reverse, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        update_search_index([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+def update_renamed_ingredient_search(sender, instance, created, **kwargs):
+    if not created:
+        update_search_index(RecipeIngredient.objects
+                            .filter(ingredient=instance)
+                            .values_list('recipe_id', flat=True)
+                            .distinct())
+
+
+def touch_recipes(recipe_ids):
+    touch(RECIPES, *(recipe_scope(recipe_id) for recipe_id in recipe_ids))
+
+
+def recipe_ingredients_changed(recipe_ids):
+    """То же, что сигналы RecipeIngredient, для массовых операций"""
+    update_search_index(recipe_ids)
+    touch_recipes(recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def touch_recipe(sender, instance, **kwargs):
+    touch_recipes([instance.pk])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def touch_recipe_ingredient(sender, instance, **kwargs):
+    touch_recipes([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def touch_recipe_ingredients(sender, instance, action, reverse, **kwargs):
+    if action.startswith('post_') and not reverse:
+        touch_recipes([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def touch_ingredients(sender, instance, **kwargs):
+    touch(INGREDIENTS)
+    touch_recipes(RecipeIngredient.objects
+                  .filter(ingredient_id=instance.pk)
+                  .values_list('recipe_id', flat=True)
+                  .distinct())
+
+
+@receiver(ingredients_bulk_changed)
+def ingredients_loaded(sender, created_ids, updated_ids, **kwargs):
+    """Массовая загрузка каталога: то же, что сигналы Ingredient"""
+    transaction.on_commit(ingredient_index.invalidate)
+    touch(INGREDIENTS)
+    if updated_ids:
+        recipe_ids = list(RecipeIngredient.objects
+                          .filter(ingredient_id__in=updated_ids)
+                          .values_list('recipe_id', flat=True)
+                          .distinct())
+        if recipe_ids:
+            recipe_ingredients_changed(recipe_ids)
+
+
+@receiver(recipes_bulk_changed)
+def recipes_changed(sender, recipe_ids, **kwargs):
+    touch_recipes(recipe_ids)
+
+
+def touches_author_fields(update_fields):
+    # Вход по токену сохраняет только last_login, смена пароля - password
+    return update_fields is None or bool(set(AUTHOR_FIELDS) & set(update_fields))
+
+
+@receiver(pre_save, sender=User)
+def remember_author_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance.pk is None or not touches_author_fields(update_fields):
+        return
+    instance._author_fields = (User.objects
+                               .filter(pk=instance.pk)
+                               .values(*AUTHOR_FIELDS)
+                               .first())
+
+
+@receiver(post_save, sender=User)
+def touch_authors(sender, instance, created, update_fields=None, **kwargs):
+    # Автор входит в выдачу рецептов, но смена пароля или вход
+    # в систему ее не меняют
+    previous = instance.__dict__.pop('_author_fields', None)
+    if created or not touches_author_fields(update_fields):
+        return
+    if previous is not None:
+        current = {field: getattr(instance, field) for field in AUTHOR_FIELDS}
+        current['avatar'] = current['avatar'].name or ''
+        if current == previous:
+            return
+    touch_recipes(Recipe.objects.filter(author_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def touch_viewer(sender, instance, **kwargs):
+    touch(viewer_scope(instance.user_id))
+
+
+@receiver(m2m_changed, sender=ShopList.recipes.through)
+def touch_shop_list_viewer(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        touch(viewer_scope(instance.user_id))
+    elif pk_set:
+        touch(*(viewer_scope(user_id) for user_id in
+                ShopList.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)))
+
+
+# Материализованные ленты (FeedItem) обновляются при записи, чтобы чтение
+# ленты пользователя с тысячами подписок оставалось одним запросом
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    FeedItem.objects.fan_out(instance)
+
+
+@receiver(post_save, sender=Subscription)
+def add_author_to_feed(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    # Ленту пользователя, перешедшего FEED_FANOUT_THRESHOLD, строит
+    # периодическая команда rebuild_feeds, до тех пор она читается соединением
+    if User.objects.filter(pk=instance.user_id, feed_materialized=True).exists():
+        FeedItem.objects.add_author(instance.user_id, instance.subscribed_to_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def remove_author_from_feed(sender, instance, **kwargs):
+    # У пользователя без материализованной ленты удалять нечего
+    FeedItem.objects.filter(user_id=instance.user_id,
+                            recipe__author_id=instance.subscribed_to_id).delete()
@@ -0,0 +1,33 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .middleware import get_query_budget
+
+
+class QueryBudgetTestMixin:
+    """
+        Проверка бюджета SQL-запросов эндпоинта из settings.QUERY_BUDGETS
+        на нескольких размерах страницы. Ловит N+1 в сериализаторах.
+    """
+    budget_page_sizes = (5, 50, 200)
+
+    def assertWithinQueryBudget(self, route, params=None, page_sizes=None,
+                                **url_kwargs):
+        budget = get_query_budget(route)
+        if budget is None:
+            self.fail(f'Для маршрута {route} не задан бюджет запросов')
+        url = reverse(route, kwargs=url_kwargs or None)
+        for page_size in page_sizes or self.budget_page_sizes:
+            query = dict(params or {}, limit=page_size)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, query)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.resolver_match.view_name, route)
+            executed = len(context.captured_queries)
+            self.assertLessEqual(
+                executed, budget,
+                f'{route} (limit={page_size}): {executed} SQL-запросов '
+                f'при бюджете {budget}\n'
+                + '\n'.join(captured['sql']
+                            for captured in context.captured_queries))
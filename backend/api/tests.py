@@ -1,7 +1,40 @@
+import base64
+import csv
+import io
+import json
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count, QuerySet
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from PIL import Image
+
+from foodgram.models import (Favorite, FeedItem, Ingredient, Recipe, RecipeEvent,
+                             RecipeIngredient, ShopList, ShopListIngredient,
+                             ShopListIngredientQuerySet, ShortLink, Subscription,
+                             TrendingRecipe, TrendingScore)
+from . import short_links
+from .management.commands import replay_traffic, update_trending
+from .middleware import get_route_stats, reset_route_stats
+from .pagination import CachedCountPaginator, CustomPagination
+from .testing import QueryBudgetTestMixin
+from .views import RecipeViewSet
 
 User = get_user_model()
 
@@ -63,3 +96,1276 @@ class UserAvatarTests(APITestCase):
         }
         response = self.client.put(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeListQueriesTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.get(id=2)
+        self.client.force_authenticate(user=self.user)
+
+    def test_recipe_list_queries_do_not_grow(self):
+        """Число запросов списка рецептов не зависит от размера страницы"""
+        url = reverse('foodgram_api:recipe-list')
+        for limit in (2, 10):
+            cache.clear()
+            with self.assertNumQueries(3):
+                response = self.client.get(url, {'limit': limit})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipe_list_flags(self):
+        """Флаги избранного, корзины и подписки берутся из аннотаций"""
+        url = reverse('foodgram_api:recipe-list')
+        response = self.client.get(url, {'limit': 20})
+        recipes = {recipe['id']: recipe for recipe in response.data['results']}
+        favorited = set(self.user.favorites.values_list('recipe_id', flat=True))
+        in_cart = set(self.user.shoplist.recipes.values_list('id', flat=True))
+        subscribed = set(self.user.subcriptions.values_list('subscribed_to_id', flat=True))
+        for recipe_id, recipe in recipes.items():
+            self.assertEqual(recipe['is_favorited'], recipe_id in favorited)
+            self.assertEqual(recipe['is_in_shopping_cart'], recipe_id in in_cart)
+            self.assertEqual(recipe['author']['is_subscribed'],
+                             recipe['author']['id'] in subscribed)
+
+    def test_recipe_list_filters(self):
+        url = reverse('foodgram_api:recipe-list')
+        response = self.client.get(url, {'is_in_shopping_cart': 1, 'limit': 20})
+        self.assertEqual(response.data['count'], self.user.shoplist.recipes.count())
+
+
+class FavoritesCountTests(APITestCase):
+    url = reverse('foodgram_api:recipe-list')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=User.objects.get(id=5))
+
+    def counts(self):
+        return dict(Recipe.objects.values_list('pk', 'favorites_count'))
+
+    def test_counter_follows_favorites(self):
+        self.assertEqual(self.counts()[1], 2)
+        favorite = reverse('foodgram_api:recipe-favorite', kwargs={'pk': 1})
+        response = self.client.post(favorite)
+        self.assertEqual(response.data['favorites_count'], 3)
+        self.assertEqual(self.client.get(reverse('foodgram_api:recipe-detail', kwargs={'pk': 1}))
+                         .data['favorites_count'], 3)
+        self.client.delete(favorite)
+        self.assertEqual(self.counts()[1], 2)
+        User.objects.get(id=3).delete()
+        self.assertEqual((self.counts()[12], self.counts()[13]), (1, 1))
+
+    def test_popularity_ordering(self):
+        expected = [pk for pk, _ in sorted(self.counts().items(),
+                                           key=lambda item: (-item[1], -item[0]))]
+        response = self.client.get(self.url, {'ordering': '-popularity', 'limit': 20})
+        self.assertEqual([recipe['id'] for recipe in response.data['results']], expected)
+
+        ids = []
+        response = self.client.get(self.url, {'ordering': '-popularity', 'limit': 3, 'cursor': ''})
+        while True:
+            ids += [recipe['id'] for recipe in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(ids, expected)
+
+    def test_reconcile_command(self):
+        Recipe.objects.filter(pk=1).update(favorites_count=10)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_favorites_count', check=True, stdout=io.StringIO())
+        with self.assertRaisesMessage(CommandError, 'process-local'):
+            call_command('reconcile_favorites_count', stdout=io.StringIO())
+        call_command('reconcile_favorites_count', allow_local_cache=True, stdout=io.StringIO())
+        self.assertEqual(self.counts()[1], 2)
+        call_command('reconcile_favorites_count', check=True, stdout=io.StringIO())
+
+
+class TrendingTests(APITestCase):
+    url = reverse('foodgram_api:recipe-trending')
+
+    def setUp(self):
+        cache.clear()
+
+    def act(self, user_id, action, recipe_id):
+        self.client.force_authenticate(user=User.objects.get(id=user_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse(f'foodgram_api:recipe-{action}', kwargs={'pk': recipe_id}))
+        self.client.force_authenticate(user=None)
+
+    def update(self):
+        call_command('update_trending', stdout=io.StringIO())
+        return [recipe['id'] for recipe in self.client.get(self.url).data]
+
+    def test_decayed_ranking_is_incremental(self):
+        self.act(5, 'favorite', 7)
+        self.act(5, 'shopping-cart', 7)
+        self.act(5, 'shopping-cart', 9)
+        # Шесть избранных три дня назад: 6 / 2^3 = 0.75 при полураспаде в сутки
+        old = RecipeEvent.objects.bulk_create(
+            RecipeEvent(recipe_id=10, kind=RecipeEvent.FAVORITE) for _ in range(6))
+        RecipeEvent.objects.filter(pk__in=[event.pk for event in old]).update(
+            created_at=timezone.now() - timedelta(days=3))
+
+        self.assertEqual(self.update(), [7, 10, 9])
+        self.assertFalse(RecipeEvent.objects.exists())
+        score = TrendingScore.objects.get(recipe_id=7).log_score
+
+        self.act(3, 'favorite', 9)
+        self.act(6, 'favorite', 9)
+        self.assertEqual(self.update(), [9, 7, 10])
+        self.assertEqual(TrendingScore.objects.get(recipe_id=7).log_score, score)
+        self.assertAlmostEqual(TrendingRecipe.objects.get(recipe_id=10).score, 0.75, places=3)
+
+    def test_late_event_is_kept(self):
+        _, gap, _ = RecipeEvent.objects.bulk_create(
+            RecipeEvent(recipe_id=7, kind=RecipeEvent.FAVORITE) for _ in range(3))
+        gap_id = gap.pk
+        gap.delete()
+        fold = update_trending.Command._fold
+
+        def commit_late_event(command, terms, batch_size):
+            # Транзакция, начатая до запуска команды, коммитится после чтения событий
+            RecipeEvent.objects.create(pk=gap_id, recipe_id=9, kind=RecipeEvent.FAVORITE)
+            fold(command, terms, batch_size)
+
+        with patch.object(update_trending.Command, '_fold', commit_late_event):
+            self.assertEqual(self.update(), [7])
+        self.assertEqual(list(RecipeEvent.objects.values_list('pk', flat=True)), [gap_id])
+        self.assertEqual(self.update(), [7, 9])
+
+    def test_single_read(self):
+        self.act(5, 'favorite', 7)
+        self.act(5, 'favorite', 9)
+        call_command('update_trending', stdout=io.StringIO())
+        # Версия снимка и сам снимок
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'limit': 1})
+        self.assertEqual([recipe['id'] for recipe in response.data], [9])
+
+    def test_new_snapshot_invalidates_without_cache_stamps(self):
+        # Команда работает в другом процессе: отметок в кэше сервера нет
+        RecipeEvent.objects.create(recipe_id=7, kind=RecipeEvent.FAVORITE)
+        self.update()
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+        RecipeEvent.objects.bulk_create(
+            RecipeEvent(recipe_id=9, kind=RecipeEvent.FAVORITE) for _ in range(2))
+        self.assertEqual(self.update(), [9, 7])
+        updated = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(updated.status_code, status.HTTP_200_OK)
+
+
+class FeedTests(APITestCase):
+    url = reverse('foodgram_api:recipe-feed')
+    # Пользователь 6 подписан на авторов 1-5; рецепт 13 его собственный
+    expected = [16, 15, 14, 12, 11, 10, 9, 8, 7, 1]
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.get(id=6)
+        self.client.force_authenticate(user=self.user)
+
+    def read_feed(self):
+        self.user.refresh_from_db()
+        response = self.client.get(self.url, {'limit': 4})
+        ids = [recipe['id'] for recipe in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [recipe['id'] for recipe in response.data['results']]
+        return ids
+
+    def test_join_and_materialized_feeds_match(self):
+        self.assertEqual(self.read_feed(), self.expected)
+        with override_settings(FEED_FANOUT_THRESHOLD=5):
+            call_command('rebuild_feeds', stdout=io.StringIO())
+        self.assertTrue(User.objects.get(id=6).feed_materialized)
+        self.assertFalse(User.objects.get(id=2).feed_materialized)
+        self.assertEqual(self.read_feed(), self.expected)
+
+        with override_settings(FEED_FANOUT_THRESHOLD=6):
+            call_command('rebuild_feeds', stdout=io.StringIO())
+        self.assertFalse(FeedItem.objects.exists())
+        self.assertEqual(self.read_feed(), self.expected)
+
+    def test_materialized_feed_follows_writes(self):
+        with override_settings(FEED_FANOUT_THRESHOLD=5):
+            call_command('rebuild_feeds', stdout=io.StringIO())
+        recipe = Recipe.objects.create(author_id=1, name='Новый', text='Текст',
+                                       image='recipes/test.png', cooking_time=5)
+        self.assertEqual(self.read_feed(), [recipe.id] + self.expected)
+        self.client.delete(reverse('foodgram_api:user-subscribe', kwargs={'pk': 2}))
+        self.assertEqual(self.read_feed(), [recipe.id, 16, 15, 14, 1])
+        self.client.post(reverse('foodgram_api:user-subscribe', kwargs={'pk': 2}))
+        self.assertEqual(self.read_feed(), [recipe.id] + self.expected)
+
+    def test_threshold_crossed_on_subscribe(self):
+        self.client.force_authenticate(user=User.objects.get(id=7))
+        with override_settings(FEED_FANOUT_THRESHOLD=1):
+            self.client.post(reverse('foodgram_api:user-subscribe', kwargs={'pk': 2}))
+            self.assertFalse(User.objects.get(id=7).feed_materialized)
+            self.assertFalse(FeedItem.objects.exists())
+            call_command('rebuild_feeds', stdout=io.StringIO())
+        self.assertTrue(User.objects.get(id=7).feed_materialized)
+        self.assertEqual(set(FeedItem.objects.filter(user_id=7)
+                             .values_list('recipe_id', flat=True)),
+                         {7, 8, 9, 10, 11, 12})
+
+    def test_query_count_does_not_depend_on_strategy(self):
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+        with override_settings(FEED_FANOUT_THRESHOLD=5):
+            call_command('rebuild_feeds', stdout=io.StringIO())
+        self.user.refresh_from_db()
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.get(id=2)
+        authors = list(User.objects.all())
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=authors[i % len(authors)],
+                   name=f'Рецепт {i}',
+                   text='Описание',
+                   image='recipes/test.png',
+                   cooking_time=10)
+            for i in range(200))
+        ingredients = list(Ingredient.objects.all()[:3])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for recipe in recipes for ingredient in ingredients)
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.user, recipe=recipe) for recipe in recipes[::3])
+        cls.recipe = recipes[0]
+
+    def setUp(self):
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_recipe_list_budget(self):
+        self.assertWithinQueryBudget('foodgram_api:recipe-list')
+
+    def test_recipe_list_filtered_budget(self):
+        self.assertWithinQueryBudget('foodgram_api:recipe-list',
+                                     params={'is_favorited': 1})
+
+    def test_recipe_detail_budget(self):
+        self.assertWithinQueryBudget('foodgram_api:recipe-detail',
+                                     page_sizes=(1,), pk=self.recipe.pk)
+
+    def test_anonymous_recipe_list_budget(self):
+        self.client.credentials()
+        self.assertWithinQueryBudget('foodgram_api:recipe-list')
+
+    @override_settings(
+        MIDDLEWARE=settings.MIDDLEWARE + ['api.middleware.QueryBudgetMiddleware'],
+        QUERY_BUDGETS={'foodgram_api:recipe-list': 1})
+    def test_middleware_warns_over_budget(self):
+        reset_route_stats()
+        with self.assertLogs('api.middleware', level='WARNING'):
+            self.client.get(reverse('foodgram_api:recipe-list'))
+        stats = get_route_stats()['foodgram_api:recipe-list']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['over_budget'], 1)
+
+
+class CursorPaginationTests(APITestCase):
+    def test_recipe_cursor_pages(self):
+        """Проход по курсорам выдает все рецепты без повторов"""
+        url = reverse('foodgram_api:recipe-list')
+        response = self.client.get(url, {'cursor': '', 'limit': 4})
+        self.assertNotIn('count', response.data)
+        ids = []
+        while True:
+            ids += [recipe['id'] for recipe in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        expected = list(Recipe.objects.order_by('-created_at', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_invalid_cursor(self):
+        url = reverse('foodgram_api:recipe-list')
+        response = self.client.get(url, {'cursor': 'не-курсор'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_users_cursor_pages(self):
+        url = reverse('foodgram_api:user-list')
+        response = self.client.get(url, {'cursor': '', 'limit': 5})
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), User.objects.count() - 5)
+
+    @patch.object(CustomPagination, 'max_page_size', 3)
+    def test_page_size_is_capped(self):
+        url = reverse('foodgram_api:recipe-list')
+        for params in ({'limit': 100000}, {'limit': 100000, 'cursor': ''}):
+            response = self.client.get(url, params)
+            self.assertEqual(len(response.data['results']), 3)
+
+
+class CachedCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.get(id=2)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('foodgram_api:recipe-list')
+
+    def test_count_is_cached(self):
+        """Повторный запрос страницы не выполняет COUNT"""
+        response = self.client.get(self.url, {'is_favorited': 1})
+        self.assertFalse(response.data['count_is_estimated'])
+        with self.assertNumQueries(2):
+            cached = self.client.get(self.url, {'is_favorited': 1})
+        self.assertEqual(cached.data['count'], response.data['count'])
+
+    def test_count_reset_on_favorite(self):
+        response = self.client.get(self.url, {'is_favorited': 1})
+        recipe = Recipe.objects.exclude(favorite__user=self.user).first()
+        self.client.post(reverse('foodgram_api:recipe-favorite',
+                                 kwargs={'pk': recipe.pk}))
+        updated = self.client.get(self.url, {'is_favorited': 1})
+        self.assertEqual(updated.data['count'], response.data['count'] + 1)
+
+    @override_settings(PAGINATION_COUNT_ESTIMATE_THRESHOLD=0)
+    @patch.object(CachedCountPaginator, '_estimate_count', return_value=12345)
+    def test_estimated_count(self, estimate):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['count'], 12345)
+        self.assertTrue(response.data['count_is_estimated'])
+
+
+class DownloadShoppingListTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.get(id=2)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('foodgram_api:download_shopping_cart')
+        self.expected = {}
+        for item in RecipeIngredient.objects.filter(
+                recipe__shop_lists__user=self.user).select_related('ingredient'):
+            key = (item.ingredient.name, item.ingredient.measurement_unit)
+            self.expected[key] = self.expected.get(key, 0) + item.amount
+
+    def download(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_download_txt(self):
+        with self.assertNumQueries(1):
+            content = self.download()
+        lines = {f'{name} {unit}: {amount}'
+                 for (name, unit), amount in self.expected.items()}
+        self.assertEqual(set(content.split('\n')), lines)
+
+    def test_download_csv(self):
+        rows = list(csv.reader(io.StringIO(self.download(format='csv'))))
+        self.assertEqual(rows[0], ['name', 'measurement_unit', 'amount'])
+        self.assertEqual({(name, unit): int(amount) for name, unit, amount in rows[1:]},
+                         self.expected)
+
+    def test_download_json(self):
+        items = json.loads(self.download(format='json'))
+        self.assertEqual({(item['name'], item['measurement_unit']): item['amount']
+                          for item in items},
+                         self.expected)
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url, {'format': 'xls'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ShopListTotalsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.get(id=3)
+        self.client.force_authenticate(user=self.user)
+
+    def totals(self):
+        return dict(self.user.shop_list_ingredients.values_list('ingredient_id', 'amount'))
+
+    def test_totals_follow_cart(self):
+        recipe = Recipe.objects.get(id=14)
+        url = reverse('foodgram_api:recipe-shopping-cart', kwargs={'pk': recipe.pk})
+        self.client.post(url)
+        self.assertEqual(self.totals(), ShopListIngredient.objects.recipe_amounts([recipe.pk]))
+        self.client.delete(url)
+        self.assertEqual(self.totals(), {})
+
+    def test_concurrent_insert_is_retried(self):
+        recipe = Recipe.objects.get(id=14)
+        amounts = ShopListIngredient.objects.recipe_amounts([recipe.pk])
+        ingredient_id = min(amounts)
+        # Строку создал параллельный запрос уже после чтения с блокировкой
+        ShopListIngredient.objects.create(user=self.user, ingredient_id=ingredient_id, amount=3)
+        select_for_update = QuerySet.select_for_update
+        reads = []
+
+        def read_before_insert(queryset, *args, **kwargs):
+            reads.append(queryset)
+            locked = select_for_update(queryset, *args, **kwargs)
+            return locked.none() if len(reads) == 1 else locked
+
+        with patch.object(ShopListIngredientQuerySet, 'select_for_update', read_before_insert):
+            response = self.client.post(
+                reverse('foodgram_api:recipe-shopping-cart', kwargs={'pk': recipe.pk}))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(reads), 2)
+        amounts[ingredient_id] += 3
+        self.assertEqual(self.totals(), amounts)
+
+    def test_totals_follow_recipe_update(self):
+        author = User.objects.get(id=4)
+        recipe = Recipe.objects.get(id=15)
+        self.user.shoplist.recipes.add(recipe)
+        ingredient = Ingredient.objects.exclude(recipe=recipe).first()
+        self.client.force_authenticate(user=author)
+        response = self.client.patch(
+            reverse('foodgram_api:recipe-detail', kwargs={'pk': recipe.pk}),
+            {'ingredients': [{'id': ingredient.id, 'amount': 7}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.totals(), {ingredient.id: 7})
+        call_command('rebuild_shopping_totals', '--check', stdout=io.StringIO())
+
+    def test_totals_follow_recipe_delete(self):
+        recipe = Recipe.objects.get(id=14)
+        self.user.shoplist.recipes.add(recipe)
+        recipe.delete()
+        self.assertEqual(self.totals(), {})
+
+    def test_rebuild_fixes_drift(self):
+        ShopListIngredient.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_shopping_totals', '--check', stdout=io.StringIO())
+        call_command('rebuild_shopping_totals', stdout=io.StringIO())
+        call_command('rebuild_shopping_totals', '--check', stdout=io.StringIO())
+
+
+class SubscriptionsTests(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.get(id=6)
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_subscriptions_budget(self):
+        self.assertWithinQueryBudget('foodgram_api:user-subscriptions',
+                                     params={'recipes_limit': 2})
+
+    def test_subscriptions_recipes_limit(self):
+        url = reverse('foodgram_api:user-subscriptions')
+        response = self.client.get(url, {'recipes_limit': 2, 'limit': 10})
+        self.assertEqual(response.data['count'], self.user.subcriptions.count())
+        for author in response.data['results']:
+            recipes = Recipe.objects.filter(author_id=author['id'])
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], recipes.count())
+            self.assertEqual([recipe['id'] for recipe in author['recipes']],
+                             list(recipes.order_by('-created_at', '-id')
+                                  .values_list('id', flat=True)[:2]))
+
+
+class IngredientIndexTests(APITestCase):
+    url = reverse('foodgram_api:ingredient-list')
+
+    def test_prefix_search_without_queries(self):
+        self.client.get(self.url, {'name': 'а'})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'name': 'Абри'})
+        expected = {ingredient.id for ingredient in Ingredient.objects.all()
+                    if ingredient.name.casefold().startswith('абри')}
+        self.assertTrue(expected)
+        self.assertEqual({item['id'] for item in response.data}, expected)
+
+    def test_index_invalidated_on_change(self):
+        self.client.get(self.url, {'name': 'а'})
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredient.objects.create(name='Абрикосовый тест',
+                                                   measurement_unit='г')
+            # До коммита версия индекса прежняя
+            response = self.client.get(self.url, {'name': 'абрикосовый т'})
+            self.assertEqual(response.data, [])
+        response = self.client.get(self.url, {'name': 'абрикосовый т'})
+        self.assertEqual([item['id'] for item in response.data], [ingredient.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.delete()
+        response = self.client.get(self.url, {'name': 'абрикосовый т'})
+        self.assertEqual(response.data, [])
+
+    def test_ranked_search(self):
+        """Сначала начало названия, затем начало слова, затем опечатки"""
+        response = self.client.get(self.url, {'name': 'масло', 'ranked': 1})
+        names = [item['name'].casefold() for item in response.data]
+        prefix = [name for name in names if name.startswith('масло')]
+        self.assertEqual(names[:len(prefix)], prefix)
+        self.assertIn('арахисовое масло', names[len(prefix):])
+
+    def test_ranked_search_typos_and_limit(self):
+        response = self.client.get(self.url, {'name': 'маркофь', 'ranked': 1})
+        self.assertEqual(response.data[0]['name'], 'морковь')
+        response = self.client.get(self.url, {'name': 'с', 'ranked': 1, 'limit': 3})
+        self.assertEqual(len(response.data), 3)
+
+
+class LoadIngredientsTests(APITestCase):
+    url = reverse('foodgram_api:ingredient-list')
+
+    def load(self, content, suffix):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8') as file:
+            file.write(content)
+            file.flush()
+            out = io.StringIO()
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('load_ingredients', file.name, batch_size=2,
+                             stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_csv_upsert_is_idempotent(self):
+        self.client.get(self.url, {'name': 'а'})
+        used = RecipeIngredient.objects.select_related('ingredient').first().ingredient
+        rows = [['name', 'measurement_unit'], ['Тестовая мука', 'г'], ['тестовая  мука', 'Г'],
+                ['Тестовый сахар', 'кг'], ['Тестовая соль', 'г'],
+                [used.name.upper(), used.measurement_unit],
+                ['абрикосовое варенье', 'г']]
+        content = io.StringIO()
+        csv.writer(content).writerows(rows)
+        count = Ingredient.objects.count()
+
+        output = self.load(content.getvalue(), '.csv')
+        self.assertIn('inserted 3, updated 1, skipped 2', output)
+        self.assertEqual(Ingredient.objects.count(), count + 3)
+        used.refresh_from_db()
+        self.assertEqual(used.name, rows[5][0])
+        response = self.client.get(self.url, {'name': 'тестовая м'})
+        self.assertEqual([item['name'] for item in response.data], ['Тестовая мука'])
+
+        output = self.load(content.getvalue(), '.csv')
+        self.assertIn('inserted 0, updated 0, skipped 6', output)
+        self.assertEqual(Ingredient.objects.count(), count + 3)
+
+    def test_json_formats(self):
+        items = [{'name': 'Тестовый перец', 'measurement_unit': 'г'},
+                 {'name': 'абрикосовое варенье', 'measurement_unit': 'г'}]
+        self.assertIn('inserted 1, updated 0, skipped 1', self.load(json.dumps(items), '.json'))
+        lines = '\n'.join(json.dumps(item) for item in items)
+        self.assertIn('inserted 0, updated 0, skipped 2', self.load(lines, '.jsonl'))
+        with self.assertRaises(CommandError):
+            self.load('', '.txt')
+        for content in (json.dumps(items)[:-1], json.dumps(items)[:-1] + ',]',
+                        json.dumps(items)[:-1] + ',,]', '[,' + json.dumps(items)[1:],
+                        json.dumps(items).replace(', ', ' '), '[1, 2]',
+                        '[{"name": "Тестовый перец"}]', '{"name": "a"}', ''):
+            with self.subTest(content=content), self.assertRaises(CommandError):
+                self.load(content, '.json')
+        with self.assertRaisesMessage(CommandError, 'Item 2: expected an object'):
+            self.load('[{"name": "a", "measurement_unit": "г"}, 2]', '.json')
+        with self.assertRaisesMessage(CommandError, 'Line 3: expected an object'):
+            self.load(lines + '\n[1]', '.jsonl')
+        with self.assertRaisesMessage(CommandError, 'Line 3: malformed JSON'):
+            self.load(lines + '\n{"name":', '.jsonl')
+
+    def test_local_cache_only_warns(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8') as file:
+            file.write(json.dumps({'name': 'Тестовый перец', 'measurement_unit': 'г'}))
+            file.flush()
+            err = io.StringIO()
+            call_command('load_ingredients', file.name, stdout=io.StringIO(), stderr=err)
+        self.assertIn('process-local', err.getvalue())
+        self.assertTrue(Ingredient.objects.filter(name='Тестовый перец').exists())
+
+    def test_duplicates_rejected_by_database(self):
+        with self.assertRaises(IntegrityError):
+            Ingredient.objects.create(name='абрикосовое варенье', measurement_unit='г')
+
+
+class IngredientUniqueMigrationTests(TransactionTestCase):
+    # Данные фикстуры восстанавливаются из снимка, а не повторной загрузкой
+    serialized_rollback = True
+    before = [('foodgram', '0020_feed')]
+    after = [('foodgram', '0022_ingredient_unique')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_duplicates_merged_before_constraint(self):
+        apps = self.migrate(self.before)
+        try:
+            Ingredient = apps.get_model('foodgram', 'Ingredient')
+            RecipeIngredient = apps.get_model('foodgram', 'RecipeIngredient')
+            ShopListIngredient = apps.get_model('foodgram', 'ShopListIngredient')
+            kept = Ingredient.objects.create(name='Тестовая мука', measurement_unit='г')
+            duplicate = Ingredient.objects.create(name='Тестовая мука', measurement_unit='г')
+            RecipeIngredient.objects.create(recipe_id=1, ingredient=duplicate, amount=5)
+            ShopListIngredient.objects.create(user_id=1, ingredient=kept, amount=2)
+            ShopListIngredient.objects.create(user_id=1, ingredient=duplicate, amount=3)
+            ShopListIngredient.objects.create(user_id=2, ingredient=duplicate, amount=4)
+        finally:
+            self.migrate(self.after)
+
+        self.assertFalse(Ingredient.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(RecipeIngredient.objects.get(recipe_id=1, amount=5).ingredient_id,
+                         kept.pk)
+        self.assertEqual(dict(ShopListIngredient.objects.filter(ingredient_id=kept.pk)
+                              .values_list('user_id', 'amount')),
+                         {1: 5, 2: 4})
+        with self.assertRaises(IntegrityError):
+            Ingredient.objects.create(name='Тестовая мука', measurement_unit='г')
+
+
+class GenerateDatasetTests(APITestCase):
+
+    def generate(self):
+        call_command('generate_dataset', users=40, recipes=80, seed=7, prefix='gen',
+                     avg_follows=5, batch_size=16, allow_local_cache=True,
+                     stdout=io.StringIO())
+        users = User.objects.filter(username__startswith='gen_')
+        return {
+            'recipes': sorted(Recipe.objects.filter(author__in=users)
+                              .values_list('author__username', 'name', 'cooking_time')),
+            'ingredients': sorted(RecipeIngredient.objects.filter(recipe__author__in=users)
+                                  .values_list('recipe__name', 'ingredient_id', 'amount')),
+            'favorites': sorted(Favorite.objects.filter(user__in=users)
+                                .values_list('user__username', 'recipe__name')),
+            'subscriptions': sorted(Subscription.objects.filter(user__in=users)
+                                    .values_list('user__username', 'subscribed_to__username')),
+            'carts': sorted(ShopList.objects.filter(user__in=users)
+                            .values_list('user__username', 'recipes__name')),
+        }
+
+    def test_deterministic_and_consistent(self):
+        first = self.generate()
+        self.assertEqual(len(first['recipes']), 80)
+        self.assertTrue(first['favorites'] and first['subscriptions'] and first['carts'])
+        self.assertFalse([row for row in first['subscriptions'] if row[0] == row[1]])
+        call_command('rebuild_shopping_totals', check=True, stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            self.generate()
+
+        User.objects.filter(username__startswith='gen_').delete()
+        self.assertEqual(self.generate(), first)
+
+    @override_settings(FEED_FANOUT_THRESHOLD=5)
+    def test_feeds_of_heavy_followers_are_materialized(self):
+        self.generate()
+        users = User.objects.filter(username__startswith='gen_').annotate(
+            follows=Count('subcriptions'))
+        heavy = users.filter(follows__gte=5)
+        self.assertTrue(heavy.exists())
+        self.assertFalse(heavy.filter(feed_materialized=False).exists())
+        self.assertFalse(users.filter(follows__lt=5, feed_materialized=True).exists())
+        self.assertEqual(FeedItem.objects.filter(user__in=heavy).count(),
+                         Recipe.objects.filter(author__subscribers__user__in=heavy).count())
+
+
+class ReplayTrafficTests(APITestCase):
+
+    def test_load_postman(self):
+        collection = {
+            'variable': [{'key': 'baseUrl', 'value': 'http://127.0.0.1:8000'},
+                         {'key': 'amount', 'value': '10'}],
+            'item': [{'name': 'recipes', 'auth': {'type': 'apikey', 'apikey': [
+                {'key': 'key', 'value': 'Authorization'},
+                {'key': 'value', 'value': 'Token {{userToken}}'}]}, 'item': [
+                {'request': {'method': 'GET', 'url': {'raw': '{{baseUrl}}/api/recipes/{{recipeId}}/'}}},
+                {'request': {'method': 'POST', 'url': {'raw': '{{baseUrl}}/api/recipes/'},
+                             'body': {'mode': 'raw', 'raw': '{"amount": {{amount}}}'}}},
+            ]}],
+        }
+        first, second = replay_traffic.load_postman(collection, {})
+        self.assertIsNone(first)
+        self.assertEqual((second['method'], second['path'], second['body']),
+                         ('POST', '/api/recipes/', b'{"amount": 10}'))
+        self.assertTrue(second['authenticated'])
+        self.assertNotIn('Authorization', second['headers'])
+        first = next(replay_traffic.load_postman(
+            collection, {'recipeId': '14', 'userToken': 'abc'}))
+        self.assertEqual(first['path'], '/api/recipes/14/')
+        self.assertEqual(first['headers']['Authorization'], 'Token abc')
+
+    def test_record_and_replay(self):
+        directory = tempfile.mkdtemp()
+        log = f'{directory}/requests.jsonl'
+        with override_settings(REQUEST_LOG_PATH=log,
+                               MIDDLEWARE=settings.MIDDLEWARE + ['api.middleware.RequestLogMiddleware']):
+            self.client.get(reverse('foodgram_api:ingredient-list'), {'name': 'абри'})
+            self.client.get(reverse('foodgram_api:recipe-detail', kwargs={'pk': 14}))
+            self.client.get(reverse('foodgram_api:recipe-detail', kwargs={'pk': 10 ** 6}))
+            self.client.delete(reverse('foodgram_api:recipe-detail', kwargs={'pk': 14}))
+        with open(log, encoding='utf-8') as file:
+            entries = [json.loads(line) for line in file]
+        self.assertEqual([entry['status'] for entry in entries], [200, 200, 404, 401])
+        self.assertEqual(entries[0]['route'], 'foodgram_api:ingredient-list')
+
+        report = f'{directory}/report.json'
+        call_command('replay_traffic', log, concurrency=1, output=report, stdout=io.StringIO())
+        with open(report, encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['skipped'], {'writes': 1})
+        self.assertEqual(report['statuses'], {'2xx': 2, '4xx': 1})
+        self.assertEqual(report['error_rate'], 0)
+        self.assertEqual(set(report['routes']), {'foodgram_api:ingredient-list',
+                                                 'foodgram_api:recipe-detail'})
+
+        # После --limit запросов журнал дальше не читается
+        with open(log, 'a', encoding='utf-8') as file:
+            file.write('not json\n')
+        out = io.StringIO()
+        call_command('replay_traffic', log, concurrency=1, limit=2, stdout=out)
+        self.assertIn('2 requests', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('replay_traffic', log, limit=0, stdout=io.StringIO())
+
+
+class RecipeSearchTests(APITestCase):
+    url = reverse('foodgram_api:recipe-list')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, text):
+        response = self.client.get(self.url, {'search': text, 'limit': 50})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_search_by_name_and_ingredient(self):
+        self.assertEqual(self.search('арбуз'), [15])
+        ingredient = RecipeIngredient.objects.filter(recipe_id=14).first().ingredient
+        self.assertIn(14, self.search(ingredient.name))
+
+    def test_search_ranking_and_updates(self):
+        author = User.objects.get(id=1)
+        in_text = Recipe.objects.create(author=author, name='Суп', text='Почти борщ',
+                                        image='recipes/test.png', cooking_time=5)
+        in_name = Recipe.objects.create(author=author, name='Борщ', text='Суп',
+                                        image='recipes/test.png', cooking_time=5)
+        self.assertEqual(self.search('борщ'), [in_name.id, in_text.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            in_name.delete()
+        self.assertEqual(self.search('борщ'), [in_text.id])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_cursor_requires_explicit_ordering(self):
+        response = self.client.get(self.url, {'search': 'арбуз', 'cursor': ''})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'search': 'арбуз', 'cursor': '',
+                                              'ordering': '-created_at'})
+        self.assertEqual([recipe['id'] for recipe in response.data['results']], [15])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.get(id=3)
+        self.client.force_authenticate(user=self.user)
+
+    def assertNotModified(self, url, response, params=None):
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        cached = self.client.get(url, params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_recipe_list_not_modified(self):
+        url = reverse('foodgram_api:recipe-list')
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+
+    def test_stamp_moves_after_commit(self):
+        url = reverse('foodgram_api:recipe-detail', kwargs={'pk': 14})
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Recipe.objects.get(pk=14).save()
+            # До фиксации другие запросы видят старые строки и старый ETag
+            self.assertNotModified(url, response)
+        for callback in callbacks:
+            callback()
+        updated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(updated.status_code, status.HTTP_200_OK)
+
+    def test_recipe_detail_changes_with_viewer_flags(self):
+        url = reverse('foodgram_api:recipe-detail', kwargs={'pk': 14})
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, recipe_id=14)
+        updated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(updated.status_code, status.HTTP_200_OK)
+        self.assertTrue(updated.data['is_favorited'])
+
+    def test_etag_differs_between_viewers(self):
+        url = reverse('foodgram_api:recipe-detail', kwargs={'pk': 14})
+        response = self.client.get(url)
+        self.client.force_authenticate(user=User.objects.get(id=2))
+        other = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(other.status_code, status.HTTP_200_OK)
+
+    def test_ingredients_not_modified(self):
+        url = reverse('foodgram_api:ingredient-list')
+        response = self.client.get(url, {'name': 'мук'})
+        self.assertNotModified(url, response, {'name': 'мук'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='мука тестовая', measurement_unit='г')
+        updated = self.client.get(url, {'name': 'мук'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(updated.status_code, status.HTTP_200_OK)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('foodgram_api:recipe-detail', kwargs={'pk': 14})
+
+    def assertCached(self, url):
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        return response
+
+    def test_anonymous_hit_and_stats(self):
+        self.assertCached(reverse('foodgram_api:recipe-list'))
+        self.assertCached(self.url)
+        admin = User.objects.create_superuser(username='cache-admin', email='cache-admin@example.com',
+                                              password='admin-password')
+        self.client.force_authenticate(user=admin)
+        stats = self.client.get(reverse('foodgram_api:cache_stats')).data
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_stats_admin_only(self):
+        response = self.client.get(reverse('foodgram_api:cache_stats'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_authenticated_not_cached(self):
+        self.client.force_authenticate(user=User.objects.get(id=3))
+        response = self.client.get(self.url)
+        self.assertNotIn('X-Cache', response)
+
+    def test_recipe_edit_invalidates(self):
+        self.assertCached(self.url)
+        Recipe.objects.filter(pk=14).update(name='Новое имя')
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=14).save()
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Новое имя')
+
+    def test_host_is_part_of_key(self):
+        self.assertEqual(self.client.get(self.url, HTTP_HOST='backend')['X-Cache'], 'MISS')
+        response = self.client.get(self.url, HTTP_HOST='localhost')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['image'].startswith('http://localhost/'))
+
+    def test_author_change_invalidates(self):
+        self.assertCached(self.url)
+        author = Recipe.objects.get(pk=14).author
+        author.first_name = 'Переименован'
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['author']['first_name'], 'Переименован')
+
+    def test_login_skips_author_check(self):
+        self.assertCached(self.url)
+        author = Recipe.objects.get(pk=14).author
+        with self.captureOnCommitCallbacks(execute=True):
+            # Только UPDATE last_login, без чтения полей автора
+            with self.assertNumQueries(1):
+                update_last_login(None, author)
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+    def test_ingredient_rename_invalidates(self):
+        self.assertCached(self.url)
+        ingredient = RecipeIngredient.objects.filter(recipe_id=14).first().ingredient
+        ingredient.name = 'переименованный ингредиент'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('переименованный ингредиент',
+                      [item['name'] for item in response.data['ingredients']])
+
+    def test_unrelated_recipe_edit_keeps_entry(self):
+        self.assertCached(self.url)
+        Recipe.objects.get(pk=1).save()
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ShortLinkTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        short_links.payloads.clear()
+
+    def get(self, hashid):
+        return self.client.get(reverse('get_recipe_by_shortlink', kwargs={'hashid': hashid}))
+
+    def test_get_link_does_not_write(self):
+        ShortLink.objects.all().delete()
+        url = reverse('foodgram_api:recipe-get-link', kwargs={'pk': 14})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertTrue(response.data['short-link'].endswith('/s/mXw'))
+        self.assertFalse(ShortLink.objects.exists())
+
+    def test_anonymous_payload_cached(self):
+        first = self.get('mXw')
+        self.assertEqual(first.data['id'], 14)
+        with self.assertNumQueries(0):
+            cached = self.get('mXw')
+        self.assertEqual(cached.data, first.data)
+
+    def test_edit_invalidates_payload(self):
+        self.get('mXw')
+        recipe = Recipe.objects.get(pk=14)
+        recipe.name = 'Обновленный рецепт'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        self.assertEqual(self.get('mXw').data['name'], 'Обновленный рецепт')
+
+    def test_legacy_hashid_fallback(self):
+        ShortLink.objects.filter(recipe_id=7).update(hashid='legacy')
+        self.assertEqual(self.get('legacy').data['id'], 7)
+
+    def test_unknown_and_deleted(self):
+        self.assertEqual(self.get('zzz').status_code, status.HTTP_404_NOT_FOUND)
+        self.get('mXw')
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=14).delete()
+        self.assertEqual(self.get('mXw').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_authenticated_flags(self):
+        user = User.objects.get(id=3)
+        Favorite.objects.create(user=user, recipe_id=14)
+        self.get('mXw')
+        self.client.force_authenticate(user=user)
+        self.assertTrue(self.get('mXw').data['is_favorited'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeCreateTests(APITestCase):
+    image = ('data:image/png;base64,'
+             'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAACVBMVEUAAAD///'
+             '9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNoAAAAggCByx'
+             'OyYQAAAABJRU5ErkJggg==')
+
+    def setUp(self):
+        self.client.force_authenticate(user=User.objects.get(id=3))
+        self.url = reverse('foodgram_api:recipe-list')
+
+    def payload(self, count):
+        return {'name': 'Новый рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': self.image,
+                'ingredients': [{'id': ingredient_id, 'amount': 5} for ingredient_id in
+                                Ingredient.objects.values_list('id', flat=True)[:count]]}
+
+    def count_queries(self, count):
+        payload = self.payload(count)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['ingredients']), count)
+        return len(context)
+
+    def test_queries_do_not_depend_on_ingredients(self):
+        self.assertEqual(self.count_queries(2), self.count_queries(30))
+
+    def test_recipe_is_searchable_with_ingredients(self):
+        self.client.post(self.url, self.payload(3), format='json')
+        recipe = Recipe.objects.latest('id')
+        self.assertEqual(recipe.recipeingredient_set.count(), 3)
+        self.assertTrue(ShortLink.objects.filter(recipe=recipe, hashid=recipe.short_hashid).exists())
+        name = recipe.ingredients.first().name
+        response = self.client.get(self.url, {'search': name})
+        self.assertIn(recipe.id, [item['id'] for item in response.data['results']])
+
+    def test_unknown_ingredient(self):
+        payload = self.payload(2)
+        payload['ingredients'].append({'id': 10 ** 6, 'amount': 1})
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.filter(name='Новый рецепт').exists())
+
+    def test_failure_leaves_nothing(self):
+        with patch.object(ShortLink.objects, 'create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.post(self.url, self.payload(3), format='json')
+        self.assertFalse(Recipe.objects.filter(name='Новый рецепт').exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeUpdateTests(APITestCase):
+    def setUp(self):
+        self.recipe = Recipe.objects.get(id=14)
+        self.client.force_authenticate(user=self.recipe.author)
+        self.url = reverse('foodgram_api:recipe-detail', kwargs={'pk': self.recipe.pk})
+        self.rows = {row.ingredient_id: row for row in self.recipe.recipeingredient_set.all()}
+
+    def patch(self, ingredients, **data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(self.url, {'ingredients': ingredients, **data},
+                                         format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [query['sql'] for query in context
+                if 'recipeingredient' in query['sql']
+                and query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+
+    def submitted(self):
+        return [{'id': ingredient_id, 'amount': row.amount}
+                for ingredient_id, row in self.rows.items()]
+
+    def test_unchanged_ingredients_not_written(self):
+        writes = self.patch(self.submitted(), name='Исправленное название')
+        self.assertEqual(writes, [])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Исправленное название')
+
+    def test_only_changed_rows_written(self):
+        ingredients = self.submitted()
+        ingredients[0]['amount'] += 1
+        removed = ingredients.pop()
+        added = Ingredient.objects.exclude(id__in=self.rows).first()
+        ingredients.append({'id': added.id, 'amount': 3})
+        writes = self.patch(ingredients)
+        self.assertEqual(len(writes), 3)
+
+        rows = {row.ingredient_id: row for row in self.recipe.recipeingredient_set.all()}
+        self.assertEqual({ingredient_id: row.amount for ingredient_id, row in rows.items()},
+                         {item['id']: item['amount'] for item in ingredients})
+        self.assertNotIn(removed['id'], rows)
+        # Неизмененные строки сохраняют свои id
+        kept = ingredients[0]['id']
+        self.assertEqual(rows[kept].pk, self.rows[kept].pk)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageVariantsTests(APITestCase):
+    def setUp(self):
+        self.author = User.objects.get(id=3)
+        self.client.force_authenticate(user=self.author)
+
+    def encoded_image(self, size=(1200, 800)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 80, 40)).save(buffer, 'JPEG')
+        return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+    def create_recipe(self):
+        ingredient = Ingredient.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('foodgram_api:recipe-list'), {
+                'name': 'Рецепт с картинкой', 'text': 'Описание', 'cooking_time': 10,
+                'image': self.encoded_image(),
+                'ingredients': [{'id': ingredient.id, 'amount': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Recipe.objects.get(pk=response.data['id'])
+
+    def test_variants_created_on_save(self):
+        recipe = self.create_recipe()
+        storage = recipe.image.storage
+        with storage.open(recipe.image_variants['card']) as file:
+            self.assertEqual(Image.open(file).size, tuple(settings.IMAGE_VARIANTS['recipes']['card']))
+        with storage.open(recipe.image_variants['card_webp']) as file:
+            self.assertEqual(Image.open(file).format, 'WEBP')
+
+    def test_list_returns_card_images(self):
+        recipe = self.create_recipe()
+        item = self.client.get(reverse('foodgram_api:recipe-list')).data['results'][0]
+        self.assertEqual(item['id'], recipe.id)
+        self.assertTrue(item['image'].endswith(recipe.image_variants['card']))
+        detail = self.client.get(reverse('foodgram_api:recipe-detail', kwargs={'pk': recipe.id}))
+        self.assertTrue(detail.data['image'].endswith(recipe.image.name))
+        self.assertIn('thumb_webp', detail.data['image_variants'])
+
+    def test_avatar_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(reverse('foodgram_api:avatar'),
+                                       {'avatar': self.encoded_image((300, 300))}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.author.refresh_from_db()
+        self.assertIn('thumb', self.author.avatar_variants)
+        me = self.client.get(reverse('foodgram_api:user-me'))
+        self.assertIn('thumb_webp', me.data['avatar_variants'])
+
+    def test_unrelated_saves_skip_variants(self):
+        with patch('api.signals.refresh_variants') as refresh, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.author.set_password('new-password')
+            self.author.save()
+            update_last_login(None, self.author)
+            recipe = Recipe.objects.get(pk=14)
+            recipe.save(update_fields=['name'])
+        refresh.assert_not_called()
+
+    def test_backfill(self):
+        recipe = self.create_recipe()
+        Recipe.objects.filter(pk=recipe.pk).update(image_variants={})
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('backfill_image_variants', stdout=out, stderr=io.StringIO())
+        with patch('api.signals.touch_recipes') as touch_recipes:
+            call_command('backfill_image_variants', allow_local_cache=True,
+                         stdout=out, stderr=io.StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+        self.assertIn('Recipe.image: generated 1', out.getvalue())
+        touch_recipes.assert_called_once_with([recipe.pk])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MultipartUploadTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.get(id=3)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('foodgram_api:recipe-list')
+
+    def image_file(self, name='dish.png', size=(64, 48)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (10, 120, 30)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def form(self, image):
+        ingredient = Ingredient.objects.first()
+        return {'name': 'Рецепт из формы', 'text': 'Описание', 'cooking_time': 15,
+                'image': image,
+                'ingredients': json.dumps([{'id': ingredient.id, 'amount': 2}])}
+
+    def test_create_recipe_with_file(self):
+        response = self.client.post(self.url, self.form(self.image_file()), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertEqual(recipe.recipeingredient_set.count(), 1)
+        with recipe.image.open('rb') as file:
+            self.assertEqual(Image.open(file).size, (64, 48))
+
+    def test_partial_update_with_file(self):
+        recipe = Recipe.objects.get(pk=self.client.post(
+            self.url, self.form(self.image_file()), format='multipart').data['id'])
+        old_image = recipe.image.name
+        response = self.client.patch(reverse('foodgram_api:recipe-detail', kwargs={'pk': recipe.pk}),
+                                     self.form(self.image_file('new.png')), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.assertNotEqual(recipe.image.name, old_image)
+
+    def test_avatar_with_file(self):
+        response = self.client.put(reverse('foodgram_api:avatar'),
+                                   {'avatar': self.image_file('me.png')}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar.name.startswith('avatars/'))
+
+    def test_rejects_wrong_type(self):
+        fake = SimpleUploadedFile('dish.png', b'#!/bin/sh\necho not an image\n',
+                                  content_type='image/png')
+        response = self.client.post(self.url, self.form(fake), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('не является изображением', response.data['detail'])
+        text = SimpleUploadedFile('dish.txt', b'text', content_type='text/plain')
+        response = self.client.post(self.url, self.form(text), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=1024)
+    def test_rejects_large_file(self):
+        response = self.client.post(self.url, self.form(self.image_file(size=(800, 800))),
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Файл слишком большой', response.data['detail'])
+        self.assertFalse(Recipe.objects.filter(name='Рецепт из формы').exists())
+
+
+@override_settings(ROOT_URLCONF='backend.asgi_urls', MEDIA_ROOT=tempfile.mkdtemp())
+class AsyncReadTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        short_links.payloads.clear()
+        self.token = Token.objects.create(user=User.objects.get(id=2))
+
+    def sync_get(self, url, params=None, headers=None):
+        with override_settings(ROOT_URLCONF='backend.urls'):
+            return self.client.get(url, params, headers=headers)
+
+    def assertSameAsSync(self, url, params=None, token=None):
+        headers = {'Authorization': f'Token {token.key}'} if token else {}
+        response = async_to_sync(self.async_client.get)(url, params or {}, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = self.sync_get(url, params, headers=headers)
+        self.assertEqual(response.json(), expected.json())
+        return response
+
+    def test_recipe_list(self):
+        url = reverse('foodgram_api:recipe-list')
+        self.assertSameAsSync(url)
+        self.assertSameAsSync(url, {'page': 2, 'limit': 3})
+        self.assertSameAsSync(url, {'is_in_shopping_cart': 1, 'limit': 50},
+                              token=self.token)
+
+    def test_recipe_detail(self):
+        url = reverse('foodgram_api:recipe-detail', kwargs={'pk': 14})
+        self.assertSameAsSync(url)
+        self.assertSameAsSync(url, token=self.token)
+
+    def test_ingredients(self):
+        self.assertSameAsSync(reverse('foodgram_api:ingredient-list'), {'name': 'мук'})
+        self.assertSameAsSync(reverse('foodgram_api:ingredient-detail', kwargs={'pk': 1}))
+
+    def test_short_link(self):
+        url = reverse('get_recipe_by_shortlink', kwargs={'hashid': 'mXw'})
+        self.assertSameAsSync(url)
+        self.assertSameAsSync(url, token=self.token)
+
+    def test_conditional_and_cache(self):
+        url = reverse('foodgram_api:recipe-detail', kwargs={'pk': 14})
+        first = async_to_sync(self.async_client.get)(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(async_to_sync(self.async_client.get)(url)['X-Cache'], 'HIT')
+        not_modified = async_to_sync(self.async_client.get)(url, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_fallbacks(self):
+        get = async_to_sync(self.async_client.get)
+        self.assertEqual(get(reverse('foodgram_api:recipe-detail', kwargs={'pk': 10 ** 6})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(get(reverse('foodgram_api:recipe-list'), {'page': 100}).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(get(reverse('foodgram_api:recipe-list'),
+                             headers={'Authorization': 'Token invalid'}).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        response = get(reverse('foodgram_api:recipe-list'), {'search': 'салат'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_reads_bypass_drf(self):
+        get = async_to_sync(self.async_client.get)
+        with patch.object(RecipeViewSet, 'list', side_effect=AssertionError), \
+                patch.object(RecipeViewSet, 'retrieve', side_effect=AssertionError):
+            self.assertEqual(get(reverse('foodgram_api:recipe-list')).status_code, status.HTTP_200_OK)
+            response = get(reverse('foodgram_api:recipe-detail', kwargs={'pk': 14}),
+                           headers={'Authorization': f'Token {self.token.key}'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_viewset_actions_reach_drf(self):
+        headers = {'Authorization': f'Token {self.token.key}'}
+        for name in ('recipe-trending', 'download_shopping_cart'):
+            response = async_to_sync(self.async_client.get)(reverse(f'foodgram_api:{name}'),
+                                                            headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_writes_go_to_drf(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        response = self.client.post(reverse('foodgram_api:recipe-list'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
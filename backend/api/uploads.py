@@ -0,0 +1,92 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import QueryDict
+from django.http.multipartparser import MultiPartParserError
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.fields import ImageField
+from rest_framework.parsers import MultiPartParser
+from rest_framework.serializers import ValidationError
+
+# Сигнатуры начала файла допустимых форматов
+IMAGE_SIGNATURES = {
+    'image/jpeg': (b'\xff\xd8\xff',),
+    'image/png': (b'\x89PNG\r\n\x1a\n',),
+    'image/gif': (b'GIF87a', b'GIF89a'),
+    'image/webp': (b'RIFF',),
+}
+
+
+def _is_image(header):
+    if header.startswith(b'RIFF'):
+        return header[8:12] == b'WEBP'
+    return any(header.startswith(signature)
+               for signatures in IMAGE_SIGNATURES.values()
+               for signature in signatures)
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+        Пишет файлы multipart-запроса во временный файл по частям,
+        поэтому память на запрос ограничена размером части.
+        Тип и размер проверяются по мере чтения тела: запрос с неверным
+        Content-Length, типом или сигнатурой отклоняется сразу.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.IMAGE_UPLOAD_MAX_SIZE + settings.DATA_UPLOAD_MAX_MEMORY_SIZE:
+            raise MultiPartParserError('Слишком большой запрос.')
+
+    def new_file(self, field_name, file_name, content_type, *args, **kwargs):
+        if content_type not in IMAGE_SIGNATURES:
+            raise MultiPartParserError(f'Недопустимый тип файла: {content_type}.')
+        self.header = b''
+        super().new_file(field_name, file_name, content_type, *args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.file.close()
+            raise MultiPartParserError('Файл слишком большой.')
+        if len(self.header) < 12:
+            self.header += raw_data[:12]
+            if len(self.header) >= 12 and not _is_image(self.header):
+                self.file.close()
+                raise MultiPartParserError('Файл не является изображением.')
+        return super().receive_data_chunk(raw_data, start)
+
+
+class ImageMultiPartParser(MultiPartParser):
+    """multipart/form-data с потоковой записью картинок на диск"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request._request.upload_handlers = [ImageUploadHandler(request._request)]
+        return super().parse(stream, media_type, parser_context)
+
+
+class ImageUploadField(Base64ImageField):
+    """Картинка строкой base64 (как шлет фронтенд) или файлом из multipart"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return ImageField.to_internal_value(self, data)
+        return super().to_internal_value(data)
+
+
+def json_form_fields(data, fields):
+    """
+        Приводит QueryDict формы к словарю, раскодируя JSON-поля
+        (вложенные списки в multipart передаются строкой).
+    """
+    if not isinstance(data, QueryDict):
+        return data
+    data = data.dict()
+    for field in fields:
+        if isinstance(data.get(field), str):
+            try:
+                data[field] = json.loads(data[field])
+            except ValueError:
+                raise ValidationError({field: 'Ожидается JSON.'})
+    return data
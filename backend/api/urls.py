@@ -4,7 +4,8 @@ from .views import (AvatarViewSet,
                     MyUserViewSet,
                     RecipeViewSet,
                     IngredientViewSet,
-                    DownloadShoppingList)
+                    DownloadShoppingList,
+                    ResponseCacheStats)
 
 app_name = 'foodgram_api'
 router = routers.DefaultRouter()
@@ -18,6 +19,7 @@ urlpatterns = [
     path('recipes/download_shopping_cart/',
          DownloadShoppingList.as_view(),
          name='download_shopping_cart'),
+    path('cache-stats/', ResponseCacheStats.as_view(), name='cache_stats'),
 
     path('', include(router.urls)),
 
@@ -1,17 +1,20 @@
 import logging
 
+from django.conf import settings
 from django.contrib.auth import get_user_model, update_session_auth_hash
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import QuerySet
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Count, F, Prefetch, QuerySet, Value
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from hashids import Hashids
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.mixins import (UpdateModelMixin,
                                    DestroyModelMixin)
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import (AllowAny,
+                                        IsAdminUser,
                                         IsAuthenticated)
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -24,10 +27,14 @@ from foodgram.models import (Subscription,
                              Ingredient,
                              Favorite,
                              ShopList,
-                             RecipeIngredient,
                              ShortLink)
-from .pagination import CustomPagination
+from . import response_cache, short_links
+from .conditional import INGREDIENTS, RECIPES, conditional_get, recipe_scope, trending_scope
+from .ingredient_index import ingredient_index
+from .pagination import CachedCountPagination, CustomPagination, KeysetPagination
 from .permisions import IsAuthorOrReadOnly
+from .response_cache import cache_anonymous_response
+from .search import search_recipes
 from .serializers import (CustomUserSerializer,
                           AvatarSerializer,
                           ChangePasswordSerializer,
@@ -35,8 +42,8 @@ from .serializers import (CustomUserSerializer,
                           IngredientSerializer,
                           RecipeUserSerializer,
                           PostRecipeSerializer)
-
-hashids = Hashids(salt='pivo', min_length=3)
+from .shopping_list import FORMATS as SHOPPING_LIST_FORMATS, get_shopping_list
+from .uploads import ImageMultiPartParser
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +55,7 @@ class MyUserViewSet(ModelViewSet):
     serializer_class = CustomUserSerializer
     queryset = User.objects.all()
     pagination_class = CustomPagination
+    cursor_ordering = ('-date_joined', '-id')
 
     def get_instance(self):
         return self.request.user
@@ -72,10 +80,28 @@ class MyUserViewSet(ModelViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'detail': 'Пользователь не авторизован'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    @action(methods=['GET'], detail=False)
+    def get_subscriptions_queryset(self):
+        """
+            Подписки одним запросом авторов с посчитанными рецептами
+            и одним запросом превью рецептов: срез в Prefetch Django
+            выполняет через ROW_NUMBER() OVER (PARTITION BY author).
+        """
+        recipes = Recipe.objects.order_by('-created_at', '-id')
+        limit = self.request.query_params.get('recipes_limit', '')
+        if limit.isdigit():
+            recipes = recipes[:int(limit)]
+        return (User.objects
+                .filter(subscribers__user=self.request.user)
+                .annotate(recipes_count=Count('recipes', distinct=True),
+                          is_subscribed=Value(True))
+                .prefetch_related(Prefetch('recipes',
+                                           queryset=recipes,
+                                           to_attr='recipe_preview'))
+                .order_by('id'))
+
+    @action(methods=['GET'], detail=False, permission_classes=(IsAuthenticated,))
     def subscriptions(self, request, *args, **kwargs):
-        limit = self.request.query_params.get('recipes_limit', None)
-        queryset = self.get_queryset().filter(subscribers__user=self.request.user)
+        queryset = self.get_subscriptions_queryset()
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = RecipeUserSerializer(page, many=True, context={'request': self.request})
@@ -83,8 +109,7 @@ class MyUserViewSet(ModelViewSet):
 
         serializer = RecipeUserSerializer(queryset,
                                           context={'request': self.request},
-                                          many=True,
-                                          limit_recipes=limit)
+                                          many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(methods=['POST', 'DELETE'], detail=True)
@@ -133,6 +158,7 @@ class AvatarViewSet(UpdateModelMixin,
     queryset = User.objects.all()
     serializer_class = AvatarSerializer
     permission_classes = (IsAuthenticated,)
+    parser_classes = (JSONParser, ImageMultiPartParser)
 
     def update(self, request, *args, **kwargs):
         instance = self.get_queryset().get(id=self.request.user.id)
@@ -155,37 +181,86 @@ class AvatarViewSet(UpdateModelMixin,
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def filter_recipes(queryset, query_params, user):
+    """Фильтры списка рецептов: автор, избранное и корзина"""
+    is_favorited: str = None
+    is_in_shopping_cart: str = None
+    author: str = query_params.get('author', None)
+    if user.is_authenticated:
+        is_favorited = query_params.get('is_favorited', None)
+        is_in_shopping_cart = query_params.get('is_in_shopping_cart', None)
+
+    if author:
+        if author.isdigit():
+            author_id = int(author)
+            queryset = queryset.filter(author__id=author_id)
+    if is_favorited:
+        if is_favorited.isdigit():
+            queryset = queryset.filter(is_favorited=True)
+    if is_in_shopping_cart:
+        if is_in_shopping_cart.isdigit():
+            queryset = queryset.filter(is_in_shopping_cart=True)
+    return queryset
+
+
+# Значения ?ordering=: порядок выдачи и ключ курсорной пагинации
+RECIPE_ORDERINGS = {
+    '-created_at': ('-created_at', '-id'),
+    'created_at': ('created_at', 'id'),
+    '-popularity': ('-favorites_count', '-id'),
+    'popularity': ('favorites_count', 'id'),
+}
+
+
+def get_recipe_ordering(query_params):
+    """Порядок из ?ordering=; None - порядок по умолчанию (или релевантность поиска)"""
+    return RECIPE_ORDERINGS.get(query_params.get('ordering', ''))
+
+
 class RecipeViewSet(ModelViewSet):
     serializer_class = PostRecipeSerializer
-    pagination_class = CustomPagination
+    pagination_class = CachedCountPagination
     permission_classes = (IsAuthorOrReadOnly,)
     queryset = Recipe.objects.all()
     filter_backends = [DjangoFilterBackend, ]
+    parser_classes = (JSONParser, ImageMultiPartParser)
+    cursor_ordering = ('-created_at', '-id')
 
+    def get_queryset(self):
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'trending', 'feed'):
+            # Сетка рецептов показывает карточки, а не оригиналы
+            context['image_variant'] = 'card'
+        return context
+
+    @conditional_get(RECIPES, per_viewer=True)
+    @cache_anonymous_response(lambda view, kwargs: [recipe_scope(kwargs['pk'])])
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @conditional_get(RECIPES, per_viewer=True)
+    @cache_anonymous_response(lambda view, kwargs: [RECIPES])
     def list(self, request, *args, **kwargs):
-        is_favorited: str = None
-        is_in_shopping_cart: str = None
-        user = request.user
-        queryset: QuerySet[Recipe] = Recipe.objects.all()
         query_params = self.request.query_params
-        author: str = query_params.get('author', None)
-        if user.is_authenticated:
-            is_favorited = query_params.get('is_favorited', None)
-            is_in_shopping_cart = query_params.get('is_in_shopping_cart', None)
-
-        if author:
-            if author.isdigit():
-                author_id = int(author)
-                queryset = queryset.filter(author__id=author_id)
-        if is_favorited:
-            if is_favorited.isdigit():
-                recipes = Favorite.objects.filter(user=user)
-                queryset = queryset.filter(favorite__in=recipes)
-        if is_in_shopping_cart:
-            if is_in_shopping_cart.isdigit():
-                shop_list = ShopList.objects.get_or_create(user=user)[0]
-                logger.debug(shop_list.recipes.all())
-                queryset = queryset.filter(shop_lists=shop_list)
+        queryset: QuerySet[Recipe] = filter_recipes(self.get_queryset(),
+                                                    query_params,
+                                                    request.user)
+        search = query_params.get('search', '').strip()
+        ordering = get_recipe_ordering(query_params)
+        if search and not ordering and 'cursor' in query_params:
+            # Ключ курсора (created_at, id) потерял бы порядок релевантности
+            return Response({'detail': 'Поиск по релевантности не поддерживает cursor, '
+                                       'используйте page или ordering'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if search:
+            queryset = search_recipes(queryset, search)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+            self.cursor_ordering = ordering
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -193,16 +268,62 @@ class RecipeViewSet(ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(methods=['GET'], detail=False)
+    @conditional_get(RECIPES, trending_scope, per_viewer=True)
+    @cache_anonymous_response(lambda view, kwargs: [RECIPES, trending_scope(view.request)])
+    def trending(self, request):
+        """
+            Популярные рецепты из снимка update_trending: один запрос
+            по индексу места, без расчета рейтинга.
+        """
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), settings.TRENDING_SIZE) if limit.isdigit() else settings.TRENDING_SIZE
+        queryset = (self.get_queryset()
+                    .filter(trending__isnull=False)
+                    .order_by('trending__position')[:limit])
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False, permission_classes=(IsAuthenticated,),
+            pagination_class=KeysetPagination)
+    @conditional_get(RECIPES, per_viewer=True)
+    def feed(self, request):
+        """
+            Рецепты авторов из подписок, новые первыми, по курсору.
+            Обычная лента - соединение с подписками по индексу
+            (author, created_at); у подписанных больше чем на
+            FEED_FANOUT_THRESHOLD авторов - страница материализованной
+            ленты FeedItem по индексу (user, created_at).
+        """
+        queryset = self.get_queryset()
+        if request.user.feed_materialized:
+            queryset = (queryset
+                        .filter(feed_items__user=request.user)
+                        .annotate(feed_created_at=F('feed_items__created_at')))
+            self.cursor_ordering = ('-feed_created_at', '-id')
+        else:
+            queryset = queryset.filter(author__subscribers__user=request.user)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     def perform_create(self, serializer):
+        with transaction.atomic():
+            recipe = serializer.save()
+            ShortLink.objects.create(recipe=recipe, hashid=recipe.short_hashid)
+        # Ответ строится по тем же предзагрузкам, что и чтение рецепта
+        serializer.instance = self.get_queryset().get(pk=recipe.pk)
+
+    def perform_update(self, serializer):
         recipe = serializer.save()
-        hashid = hashids.encode(recipe.id)
-        ShortLink.objects.create(recipe=recipe, hashid=hashid)
+        # Ингредиенты были предзагружены до изменения
+        serializer.instance = self.get_queryset().get(pk=recipe.pk)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
 
         if serializer.is_valid():
-            ingredients_data = request.data.get("ingredients", [])
+            ingredients_data = serializer.validated_data.get("recipeingredient_set", [])
             non_exist_ingredients = self.__check_ingredients_exist(ingredients_data)
             if non_exist_ingredients:
                 return non_exist_ingredients
@@ -220,7 +341,7 @@ class RecipeViewSet(ModelViewSet):
                                          data=request.data,
                                          partial=True)
         if serializer.is_valid():
-            ingredients_data = request.data.get("ingredients", [])
+            ingredients_data = serializer.validated_data.get("recipeingredient_set", [])
             non_exist_ingredients = self.__check_ingredients_exist(ingredients_data)
             if non_exist_ingredients:
                 return non_exist_ingredients
@@ -229,17 +350,16 @@ class RecipeViewSet(ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def __check_ingredients_exist(self, ingredients):
-        for ingredient in ingredients:
-            id = int(ingredient.get("id", ''))
-            if not Ingredient.objects.filter(id=id).exists():
-                return Response({'detail': 'Ингредиент не существует'}, status=status.HTTP_400_BAD_REQUEST)
+        ids = {int(ingredient.get("id", '')) for ingredient in ingredients}
+        if Ingredient.objects.filter(id__in=ids).count() != len(ids):
+            return Response({'detail': 'Ингредиент не существует'}, status=status.HTTP_400_BAD_REQUEST)
         return None
 
     @action(methods=['GET'], detail=True, url_path='get-link')
     def get_link(self, request, pk=None):
-        recipe = self.get_object()
-        short_link_obj = recipe.get_short_link()
-        short_link = f'http://localhost:8000/s/{short_link_obj.hashid}'
+        # Ссылка вычисляется из id, достаточно проверить, что рецепт есть
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        short_link = f'http://localhost:8000/s/{recipe.short_hashid}'
         return Response({'short-link': short_link}, status=status.HTTP_200_OK)
 
     @action(methods=['POST', 'DELETE'], detail=True)
@@ -261,6 +381,8 @@ class RecipeViewSet(ModelViewSet):
                                                       exclude_author=True,
                                                       exclude_serializer_method=True)
                         Favorite.objects.create(user=user, recipe=recipe)
+                        # Счетчик увеличен в БД сигналом
+                        recipe.favorites_count += 1
                         return Response(serializer.data, status.HTTP_201_CREATED)
                 except ObjectDoesNotExist:
                     return Response({'detail': 'Рецепт не найден'},
@@ -321,17 +443,59 @@ class RecipeViewSet(ModelViewSet):
 
 
 class GetRecipeByShortLink(APIView):
+    def load(self, recipe_id):
+        recipe = (Recipe.objects
+                  .with_related()
+                  .with_user_flags(self.request.user)
+                  .prefetch_related('ingredients')
+                  .filter(pk=recipe_id)
+                  .first())
+        if recipe is None:
+            return None
+        return RecipeSerializer(recipe, context={'request': self.request}).data
+
     def get(self, request, hashid):
-        short_link = get_object_or_404(ShortLink, hashid=hashid)
-        recipe = short_link.recipe
-        serializer = RecipeSerializer(recipe, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        if request.user.is_authenticated:
+            recipe_id = short_links.resolve(hashid)
+            payload = self.load(recipe_id) if recipe_id is not None else None
+        else:
+            payload = short_links.get_payload(request, hashid, self.load)
+        if payload is None:
+            raise Http404
+        return Response(payload, status=status.HTTP_200_OK)
+
+
+class ResponseCacheStats(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(response_cache.get_stats())
+
+
+def search_ingredients(query_params):
+    """Автодополнение обслуживается индексом в памяти, без запроса к БД"""
+    name = query_params.get('name', None)
+    if name and query_params.get('ranked') == '1':
+        limit = query_params.get('limit', '')
+        limit = min(int(limit), settings.INGREDIENT_SEARCH_LIMIT) if limit.isdigit() else None
+        return ingredient_index.ranked_search(name, limit)
+    if name:
+        return ingredient_index.search(name)
+    return ingredient_index.all()
 
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
 
+    @conditional_get(INGREDIENTS)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @conditional_get(INGREDIENTS)
+    def list(self, request, *args, **kwargs):
+        return Response(search_ingredients(self.request.query_params))
+
     def get_queryset(self):
         queryset = super().get_queryset()
         name = self.request.query_params.get('name', None)
@@ -343,26 +507,20 @@ class IngredientViewSet(ReadOnlyModelViewSet):
 
 
 class DownloadShoppingList(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= здесь выбирает формат файла, а не рендерер DRF
+        return super().perform_content_negotiation(request, force=True)
+
     def get(self, request, *args, **kwargs):
-        user = request.user
-        shop_list = ShopList.objects.get_or_create(user=user)[0]
-        recipes = shop_list.recipes.all()
-        ingredients_res = {}
-        for recipe in recipes:
-            ingredients = RecipeIngredient.objects.filter(recipe=recipe)
-            for ingredient in ingredients:
-                name = ingredient.ingredient.name
-                unit = ingredient.ingredient.measurement_unit
-                amount = ingredient.amount
-                name_mes = f'{name} {unit}'
-                if name_mes in ingredients_res:
-                    ingredients_res[name_mes] += amount
-                else:
-                    ingredients_res[name_mes] = amount
-
-        # Создаем текстовый файл
-        file_content = "\n".join(f'{key}: {value}' for key, value in ingredients_res.items())
-        response = HttpResponse(file_content, content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response({'detail': f'Формат {file_format} не поддерживается'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        render, content_type = SHOPPING_LIST_FORMATS[file_format]
+        rows = get_shopping_list(request.user).iterator()
+        response = StreamingHttpResponse(render(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="shopping_list.{file_format}"'
 
         return response
@@ -0,0 +1,20 @@
+"""
+URL configuration for running under ASGI (ASYNC_READ_VIEWS=True).
+
+Same routes as backend.urls, but reads of recipes, ingredients and short
+links are served by async views from api.async_views.
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+from api.async_views import read_write_split, short_link
+from api.views import GetRecipeByShortLink
+
+urlpatterns = [
+    path('s/<str:hashid>',
+         read_write_split(short_link, GetRecipeByShortLink.as_view()),
+         name='get_recipe_by_shortlink'),
+    path('api/auth/', include('djoser.urls.authtoken')),
+    path('api/', include('api.async_urls', namespace='foodgram_api')),
+    path('admin/', admin.site.urls),
+]
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'djoser',
     'foodgram.apps.FoodgramConfig',
+    'api.apps.ApiConfig',
     'django_filters'
 
 ]
@@ -54,7 +55,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 AUTH_USER_MODEL = 'foodgram.User'
-ROOT_URLCONF = 'backend.urls'
+# Под ASGI чтение рецептов, ингредиентов и коротких ссылок обслуживают
+# async-вьюхи (backend.asgi_urls), под WSGI - обычные вьюхи DRF
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+ROOT_URLCONF = 'backend.asgi_urls' if ASYNC_READ_VIEWS else 'backend.urls'
 
 TEMPLATES = [
     {
@@ -87,6 +91,24 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT', 5432)
     }
 }
+# DB_ENGINE=sqlite - локальная БД без PostgreSQL (разработка, бенчмарки)
+if os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Кэш Django: по умолчанию в памяти процесса, для нескольких воркеров
+# можно указать общий бэкенд (например, redis или файловый)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -136,6 +158,46 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
     ]
 }
+# Верхняя граница параметра limit. Страница корзины фронтенда
+# запрашивает limit=999, поэтому меньше 1000 не ставить.
+PAGINATION_MAX_PAGE_SIZE = int(os.getenv('PAGINATION_MAX_PAGE_SIZE', 1000))
+# Время жизни закэшированного count списков (секунды) и порог,
+# выше которого на PostgreSQL отдается оценка планировщика
+PAGINATION_COUNT_CACHE_TTL = int(os.getenv('PAGINATION_COUNT_CACHE_TTL', 30))
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', 10000))
+# Ранжированный поиск ингредиентов (?name=...&ranked=1): максимум
+# результатов и допустимое число опечаток
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 20))
+INGREDIENT_SEARCH_MAX_TYPOS = int(os.getenv('INGREDIENT_SEARCH_MAX_TYPOS', 2))
+# Полнотекстовый поиск рецептов (?search=): конфигурация tsvector
+# на PostgreSQL и максимум совпадений, которые ранжируются на SQLite.
+# Векторы строятся с этой конфигурацией; после ее смены их нужно
+# пересчитать командой rebuild_search_index.
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+RECIPE_SEARCH_MAX_RESULTS = int(os.getenv('RECIPE_SEARCH_MAX_RESULTS', 1000))
+# Кэш ответов для анонимных пользователей (api.response_cache)
+RESPONSE_CACHE_ALIAS = os.getenv('RESPONSE_CACHE_ALIAS', 'default')
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 300))
+# Сколько рецептов по коротким ссылкам помнит каждый процесс
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 1024))
+# Размеры уменьшенных копий картинок (ширина, высота) и качество JPEG/WebP
+IMAGE_VARIANTS = {
+    'recipes': {'card': (480, 320), 'thumb': (160, 160)},
+    'avatars': {'thumb': (96, 96)},
+}
+IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', 80))
+# Наибольший размер картинки, загружаемой файлом (multipart/form-data)
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', 5 * 1024 * 1024))
+# Популярные рецепты (update_trending): период полураспада веса события,
+# размер снимка top-K и веса событий. Новый период полураспада
+# действует только на события после его смены.
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 24))
+TRENDING_SIZE = int(os.getenv('TRENDING_SIZE', 100))
+TRENDING_WEIGHTS = {'favorite': 1.0, 'cart': 0.5}
+# Лента подписок: начиная с этого числа подписок лента пользователя
+# материализуется в FeedItem, иначе читается соединением с подписками
+FEED_FANOUT_THRESHOLD = int(os.getenv('FEED_FANOUT_THRESHOLD', 1000))
 AUTHENTICATION_BACKENDS = [
     "djoser.auth_backends.LoginFieldBackend",
 ]
@@ -158,3 +220,23 @@ LOGGING = {
         "level": "WARNING",
     },
 }
+
+# Учет SQL-запросов по маршрутам (api.middleware.QueryBudgetMiddleware).
+# Бюджет - максимальное число запросов на один HTTP-запрос,
+# включая запрос аутентификации по токену.
+QUERY_BUDGET_ENABLED = os.getenv('QUERY_BUDGET_ENABLED', 'False') == 'True'
+QUERY_BUDGET_DB_TIME_MS = int(os.getenv('QUERY_BUDGET_DB_TIME_MS', 500))
+QUERY_BUDGETS = {
+    'foodgram_api:recipe-list': 4,
+    'foodgram_api:recipe-detail': 3,
+    'foodgram_api:ingredient-list': 2,
+    'foodgram_api:user-subscriptions': 4,
+}
+if QUERY_BUDGET_ENABLED:
+    MIDDLEWARE.append('api.middleware.QueryBudgetMiddleware')
+
+# Журнал запросов в JSON Lines для replay_traffic (api.middleware.RequestLogMiddleware).
+# Пишутся метод, путь и статус, без заголовков и тела запроса.
+REQUEST_LOG_PATH = os.getenv('REQUEST_LOG_PATH', '')
+if REQUEST_LOG_PATH:
+    MIDDLEWARE.append('api.middleware.RequestLogMiddleware')
@@ -11,5 +11,8 @@ python3 manage.py collectstatic --noinput
 # Копирование статических файлов
 cp -r /app/collected_static/. /backend_static/static/
 
-# Запуск Gunicorn
+# Запуск Gunicorn: с ASYNC_READ_VIEWS=True - ASGI-воркеры uvicorn
+if [ "$ASYNC_READ_VIEWS" = "True" ]; then
+    exec gunicorn --bind 0.0.0.0:80 -k uvicorn_worker.UvicornWorker backend.asgi
+fi
 exec gunicorn --bind 0.0.0.0:80 backend.wsgi
\ No newline at end of file
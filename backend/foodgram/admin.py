@@ -1,14 +1,16 @@
 from django.contrib import admin
-from django.db.models import Count
 
 from foodgram.models import (User,
+                             FeedItem,
                              Recipe,
                              Ingredient,
                              RecipeIngredient,
                              Favorite,
                              ShopList,
+                             ShopListIngredient,
                              ShortLink,
-                             Subscription)
+                             Subscription,
+                             TrendingRecipe)
 
 
 @admin.register(Subscription)
@@ -33,26 +35,18 @@ class RecipeIngredientInline(admin.TabularInline):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = [RecipeIngredientInline]
-    list_display = ('name', 'get_author_name', 'favorite_count')
+    list_display = ('name', 'get_author_name', 'favorites_count')
     search_fields = ('author__first_name', 'name',)
-    readonly_fields = ('favorite_count',)
+    readonly_fields = ('favorites_count',)
+    list_select_related = ('author',)
 
     def get_author_name(self, obj):
         return obj.author.first_name
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        queryset = queryset.annotate(favorite_count=Count('favorite'))
-        return queryset
-
-    def favorite_count(self, obj):
-        return obj.favorite_count
-
     def get_ingredients(self, obj):
         return ", ".join(ingredient.name for ingredient in obj.ingredients.all())
 
     get_ingredients.short_description = 'Ингредиенты'
-    favorite_count.short_description = 'Добавлений в избранное'
     get_author_name.short_description = 'Имя автора'
 
 
@@ -75,6 +69,11 @@ class ShopListAdmin(admin.ModelAdmin):
         return ", ".join(recipe.name for recipe in obj.recipes.all())
 
 
+@admin.register(ShopListIngredient)
+class ShopListIngredientAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+
+
 @admin.register(ShortLink)
 class ShortLinkAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'hashid')
@@ -83,3 +82,15 @@ class ShortLinkAdmin(admin.ModelAdmin):
 @admin.register(RecipeIngredient)
 class RecipeIngredientAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'ingredient', 'amount')
+
+
+@admin.register(TrendingRecipe)
+class TrendingRecipeAdmin(admin.ModelAdmin):
+    list_display = ('position', 'recipe', 'score', 'computed_at')
+    list_select_related = ('recipe',)
+
+
+@admin.register(FeedItem)
+class FeedItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe', 'created_at')
+    list_select_related = ('user', 'recipe')
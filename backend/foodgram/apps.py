@@ -4,7 +4,14 @@ from django.db.models.signals import post_migrate
 
 def load_fixtures(sender, **kwargs):
     from django.core.management import call_command
+    from django.db.models import Max
+    from .models import Recipe, RecipeEvent
+    last_event = RecipeEvent.objects.aggregate(last=Max('id'))['last'] or 0
     call_command('loaddata', 'fixture.json')
+    # Корзины фикстуры - не свежие действия, в тренды они попадать не должны
+    RecipeEvent.objects.filter(id__gt=last_event).delete()
+    # loaddata сохраняет избранное с raw=True, счетчики не обновляются
+    Recipe.objects.refresh_favorites_count()
 
 
 class FoodgramConfig(AppConfig):
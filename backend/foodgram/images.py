@@ -0,0 +1,89 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+WEBP = 'webp'
+
+
+def variant_name(name, variant, extension):
+    """recipes/abc.png -> recipes/variants/abc_card.webp"""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{variant}.{extension}')
+
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=settings.IMAGE_VARIANT_QUALITY,
+                                  optimize=True, progressive=True)
+    elif image_format == 'PNG':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.save(buffer, 'WEBP', quality=settings.IMAGE_VARIANT_QUALITY, method=4)
+    return ContentFile(buffer.getvalue())
+
+
+def _save(storage, name, content):
+    if storage.exists(name):
+        storage.delete(name)
+    return storage.save(name, content)
+
+
+def generate_variants(field_file, sizes):
+    """
+        Создает уменьшенные копии изображения (ImageOps.fit под каждый
+        размер из sizes) в исходном формате и в WebP, а также WebP-копию
+        оригинала. Возвращает {'source': имя оригинала, вариант: имя файла}.
+    """
+    storage = field_file.storage
+    with field_file.open('rb') as file:
+        original = Image.open(file)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+    has_alpha = original.mode in ('RGBA', 'LA', 'P')
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if has_alpha else 'RGB')
+    # Прозрачность сохраняем в PNG, остальное в JPEG
+    image_format, extension = ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+
+    variants = {'source': field_file.name}
+    variants[WEBP] = _save(storage, variant_name(field_file.name, 'full', WEBP),
+                           _encode(original, WEBP))
+    for variant, size in sizes.items():
+        resized = ImageOps.fit(original, tuple(size), Image.Resampling.LANCZOS)
+        variants[variant] = _save(storage, variant_name(field_file.name, variant, extension),
+                                  _encode(resized, image_format))
+        variants[f'{variant}_{WEBP}'] = _save(storage, variant_name(field_file.name, variant, WEBP),
+                                              _encode(resized, WEBP))
+    return variants
+
+
+def refresh_variants(instance, field, variants_field, sizes, force=False):
+    """
+        Перестраивает варианты, если файл поля изменился (или force).
+        Пишет результат через update(), чтобы не вызывать сигналы сохранения.
+        Возвращает True, если варианты были пересозданы.
+    """
+    field_file = getattr(instance, field)
+    current = getattr(instance, variants_field) or {}
+    if field_file and not force and current.get('source') == field_file.name:
+        return False
+    if field_file and field_file.storage.exists(field_file.name):
+        variants = generate_variants(field_file, sizes)
+    else:
+        variants = {}
+    if variants == current:
+        return False
+
+    setattr(instance, variants_field, variants)
+    type(instance).objects.filter(pk=instance.pk).update(**{variants_field: variants})
+    # Файлы прежней картинки больше не нужны
+    storage = field_file.storage
+    stale = set(current.values()) - set(variants.values()) - {current.get('source')}
+    for name in stale:
+        storage.delete(name)
+    return bool(variants)
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from foodgram.images import refresh_variants
+from foodgram.management.shared_cache import add_local_cache_argument, require_shared_cache
+from foodgram.models import Recipe, User
+from foodgram.signals import recipes_bulk_changed
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail and WebP variants for existing recipe images and avatars'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate variants even if they are up to date')
+        add_local_cache_argument(parser)
+
+    def handle(self, *args, **options):
+        require_shared_cache(options)
+        targets = (
+            (Recipe.objects.exclude(image=''), 'image', 'image_variants',
+             settings.IMAGE_VARIANTS['recipes']),
+            (User.objects.exclude(avatar=''), 'avatar', 'avatar_variants',
+             settings.IMAGE_VARIANTS['avatars']),
+        )
+        changed = {Recipe: [], User: []}
+        for queryset, field, variants_field, sizes in targets:
+            created = skipped = failed = 0
+            for instance in queryset.only('pk', field, variants_field).iterator():
+                try:
+                    if refresh_variants(instance, field, variants_field, sizes,
+                                        force=options['force']):
+                        created += 1
+                        changed[queryset.model].append(instance.pk)
+                    else:
+                        skipped += 1
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'{queryset.model.__name__} {instance.pk}: {error}')
+            self.stdout.write(self.style.SUCCESS(
+                f'{queryset.model.__name__}.{field}: generated {created}, '
+                f'skipped {skipped}, failed {failed}'))
+        # refresh_variants пишет через update(): ETag и кэш ответов с адресами
+        # вариантов сбрасываются так же, как в сигнале refresh_image_variants
+        recipe_ids = set(changed[Recipe])
+        recipe_ids.update(Recipe.objects.filter(author_id__in=changed[User])
+                          .values_list('pk', flat=True))
+        if recipe_ids:
+            recipes_bulk_changed.send(sender=Recipe, recipe_ids=sorted(recipe_ids))
@@ -1,22 +1,189 @@
+import csv
 import json
-from django.core.management.base import BaseCommand
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from foodgram.management.shared_cache import warn_local_cache
 from foodgram.models import Ingredient
+from foodgram.signals import ingredients_bulk_changed
+
+HEADER = ['name', 'measurement_unit']
+
+
+def normalize(value):
+    return ' '.join(str(value).split())
+
+
+def read_csv(file):
+    for number, row in enumerate(csv.reader(file), 1):
+        if number == 1 and [cell.strip().lower() for cell in row] == HEADER:
+            continue
+        if len(row) != 2:
+            raise CommandError(f'Line {number}: expected name,measurement_unit, got {row!r}')
+        yield row
+
+
+def parse_item(item, where):
+    if not isinstance(item, dict) or not set(HEADER) <= item.keys():
+        raise CommandError(f'{where}: expected an object with name and measurement_unit, '
+                           f'got {item!r}')
+    return item['name'], item['measurement_unit']
+
+
+def read_json(file, chunk_size=64 * 1024):
+    """Массив объектов разбирается по частям, без чтения файла целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    exhausted = False
+    # Что ожидается дальше: '[', первый элемент или ']', элемент после ',',
+    # ',' или ']' после элемента
+    expected = 'start'
+    number = 0
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if exhausted:
+                if expected == 'start':
+                    raise CommandError('JSON file must contain an array of ingredients')
+                raise CommandError('Unexpected end of JSON file')
+            chunk = file.read(chunk_size)
+            exhausted = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        char = buffer[position]
+        if expected == 'start':
+            if char != '[':
+                raise CommandError('JSON file must contain an array of ingredients')
+            expected = 'first'
+            position += 1
+        elif expected == 'separator' or (expected == 'first' and char == ']'):
+            if char == ']':
+                return
+            if char != ',':
+                raise CommandError(f'Item {number}: expected "," or "]" after it')
+            expected = 'item'
+            position += 1
+        elif char in ',]':
+            raise CommandError(f'Item {number + 1}: missing value')
+        else:
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if exhausted:
+                    raise CommandError(f'Item {number + 1}: malformed JSON ({error.msg})')
+                # Объект разрезан границей блока: дочитываем
+                chunk = file.read(chunk_size)
+                exhausted = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            number += 1
+            expected = 'separator'
+            yield parse_item(item, f'Item {number}')
+
+
+def read_json_lines(file):
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise CommandError(f'Line {number}: malformed JSON ({error.msg})')
+            yield parse_item(item, f'Line {number}')
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'jsonl': read_json_lines}
 
 
 class Command(BaseCommand):
-    help = 'Load ingredients from JSON file'
+    help = ('Load the ingredient catalogue from CSV, a JSON array or JSON Lines; '
+            'all formats are read incrementally. Rows are matched on '
+            '(name, measurement_unit) ignoring case and extra spaces, so reruns '
+            'only apply the differences.')
 
     def add_arguments(self, parser):
-        parser.add_argument('filename', type=str, help='Path to JSON file')
+        parser.add_argument('filename', type=str, help='Path to CSV, JSON or JSON Lines file')
+        parser.add_argument('--format', choices=READERS,
+                            help='File format; guessed from the extension by default')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk_create/bulk_update query')
 
     def handle(self, *args, **options):
         filename = options['filename']
-        with open(filename, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            for item in data:
-                ingredient = Ingredient(
-                    name=item['name'],
-                    measurement_unit=item['measurement_unit'],
-                )
-                ingredient.save()
-                self.stdout.write(self.style.SUCCESS(f'Successfully added {ingredient.name}'))
+        file_format = options['format'] or os.path.splitext(filename)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Unknown format {file_format!r}, use --format')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        warn_local_cache(self)
+
+        started = time.perf_counter()
+        existing = {(name.casefold(), unit.casefold()): (pk, name, unit)
+                    for pk, name, unit in
+                    Ingredient.objects.values_list('pk', 'name', 'measurement_unit')}
+        seen = set()
+        to_create = []
+        to_update = []
+        created_ids = []
+        updated_ids = []
+        total = skipped = 0
+
+        with transaction.atomic(), open(filename, encoding='utf-8', newline='') as file:
+            for name, unit in READERS[file_format](file):
+                total += 1
+                name, unit = normalize(name), normalize(unit)
+                key = (name.casefold(), unit.casefold())
+                if not name or not unit or key in seen:
+                    skipped += 1
+                    continue
+                seen.add(key)
+                if key not in existing:
+                    to_create.append(Ingredient(name=name, measurement_unit=unit))
+                elif existing[key][1:] != (name, unit):
+                    # Та же позиция каталога, но исправлено написание
+                    to_update.append(Ingredient(pk=existing[key][0], name=name,
+                                                measurement_unit=unit))
+                else:
+                    skipped += 1
+
+                if len(to_create) >= batch_size:
+                    created_ids += self._create(to_create)
+                    to_create = []
+                if len(to_update) >= batch_size:
+                    updated_ids += self._update(to_update)
+                    to_update = []
+            created_ids += self._create(to_create)
+            updated_ids += self._update(to_update)
+
+        if created_ids or updated_ids:
+            ingredients_bulk_changed.send(sender=Ingredient,
+                                          created_ids=created_ids,
+                                          updated_ids=updated_ids)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {total} rows in {elapsed * 1000:.0f} ms '
+            f'({total / elapsed if elapsed else 0:.0f} rows/s): '
+            f'inserted {len(created_ids)}, updated {len(updated_ids)}, skipped {skipped}'))
+
+    def _create(self, ingredients):
+        if not ingredients:
+            return []
+        created = Ingredient.objects.bulk_create(ingredients)
+        if created[0].pk is None:
+            # Бэкенд не вернул id (старые версии СУБД): находим их по ключу
+            names = {ingredient.name for ingredient in created}
+            keys = {(ingredient.name, ingredient.measurement_unit) for ingredient in created}
+            return [pk for pk, name, unit in Ingredient.objects.filter(name__in=names)
+                    .values_list('pk', 'name', 'measurement_unit') if (name, unit) in keys]
+        return [ingredient.pk for ingredient in created]
+
+    def _update(self, ingredients):
+        if not ingredients:
+            return []
+        Ingredient.objects.bulk_update(ingredients, ['name', 'measurement_unit'])
+        return [ingredient.pk for ingredient in ingredients]
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from foodgram.models import ShopListIngredient
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify precomputed shopping cart ingredient totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report drift, do not rewrite totals')
+
+    def handle(self, *args, **options):
+        expected = ShopListIngredient.objects.expected_totals()
+        stored = dict(((user_id, ingredient_id), amount)
+                      for user_id, ingredient_id, amount
+                      in ShopListIngredient.objects.values_list('user_id', 'ingredient_id', 'amount'))
+        drift = {key for key in expected.keys() | stored.keys()
+                 if expected.get(key) != stored.get(key)}
+        for user_id, ingredient_id in sorted(drift):
+            key = (user_id, ingredient_id)
+            self.stdout.write(f'user={user_id} ingredient={ingredient_id}: '
+                              f'stored={stored.get(key, 0)} expected={expected.get(key, 0)}')
+
+        if options['check']:
+            if drift:
+                raise CommandError(f'Found {len(drift)} drifted totals')
+            self.stdout.write(self.style.SUCCESS('Shopping totals are consistent'))
+            return
+
+        ShopListIngredient.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(expected)} totals, fixed {len(drift)} drifted rows'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F
+
+from foodgram.management.shared_cache import add_local_cache_argument, require_shared_cache
+from foodgram.models import Recipe
+from foodgram.signals import recipes_bulk_changed
+
+
+class Command(BaseCommand):
+    help = 'Verify or repair denormalized recipe favorites_count against the favorites table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report drift, do not rewrite counters')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        add_local_cache_argument(parser)
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            require_shared_cache(options)
+        drift = list(Recipe.objects
+                     .annotate(actual=Count('favorite'))
+                     .exclude(favorites_count=F('actual'))
+                     .order_by('pk')
+                     .values_list('pk', 'favorites_count', 'actual'))
+        for recipe_id, stored, actual in drift:
+            self.stdout.write(f'recipe={recipe_id}: stored={stored} expected={actual}')
+
+        if options['check']:
+            if drift:
+                raise CommandError(f'Found {len(drift)} drifted counters')
+            self.stdout.write(self.style.SUCCESS('Favorite counters are consistent'))
+            return
+
+        recipe_ids = [recipe_id for recipe_id, _, _ in drift]
+        for start in range(0, len(recipe_ids), options['batch_size']):
+            Recipe.objects.filter(
+                pk__in=recipe_ids[start:start + options['batch_size']]
+            ).refresh_favorites_count()
+        if recipe_ids:
+            recipes_bulk_changed.send(sender=Recipe, recipe_ids=recipe_ids)
+        self.stdout.write(self.style.SUCCESS(f'Fixed {len(recipe_ids)} drifted counters'))
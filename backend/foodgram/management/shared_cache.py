@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import CommandError
+
+# Бэкенды, содержимое которых видно только процессу, который их заполнил
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def add_local_cache_argument(parser):
+    parser.add_argument('--allow-local-cache', action='store_true',
+                        help='Run even though CACHES["default"] is process-local; '
+                             'the server must be restarted afterwards')
+
+
+def is_local_cache():
+    return settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+def require_shared_cache(options):
+    """
+        Команды сбрасывают ETag и кэш ответов отметками в кэше по умолчанию.
+        Отметки в LocMemCache видит только процесс команды, и сервер
+        продолжил бы отдавать старые данные.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if is_local_cache() and not options['allow_local_cache']:
+        raise CommandError(
+            f'CACHES["default"] is process-local ({backend}): the running server would '
+            f'not see the invalidation and keep serving stale ETags and cached '
+            f'responses. Configure a shared CACHE_BACKEND or pass --allow-local-cache '
+            f'and restart the server.')
+
+
+def warn_local_cache(command):
+    """
+        Для команд первоначальной настройки (загрузка каталога), которые
+        должны работать и с настройками по умолчанию: вместо ошибки
+        предупреждение о необходимости перезапустить сервер.
+    """
+    if is_local_cache():
+        command.stderr.write(command.style.WARNING(
+            f'CACHES["default"] is process-local '
+            f'({settings.CACHES["default"]["BACKEND"]}): restart the running server '
+            f'so that it drops stale ETags, cached responses and the ingredient index.'))
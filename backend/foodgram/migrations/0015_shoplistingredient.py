@@ -0,0 +1,45 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_totals(apps, schema_editor):
+    RecipeIngredient = apps.get_model('foodgram', 'RecipeIngredient')
+    ShopListIngredient = apps.get_model('foodgram', 'ShopListIngredient')
+    rows = (RecipeIngredient.objects
+            .filter(recipe__shop_lists__isnull=False)
+            .values_list('recipe__shop_lists__user_id', 'ingredient_id')
+            .annotate(total=Sum('amount'))
+            .order_by())
+    ShopListIngredient.objects.bulk_create(
+        ShopListIngredient(user_id=user_id, ingredient_id=ingredient_id,
+                           amount=total)
+        for user_id, ingredient_id, total in rows if total > 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0014_recipe_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopListIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='foodgram.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_list_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент списка покупок',
+                'verbose_name_plural': 'Ингредиенты списков покупок',
+                'unique_together': {('user', 'ingredient')},
+            },
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
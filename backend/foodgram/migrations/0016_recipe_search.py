@@ -0,0 +1,68 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:40
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    'CREATE INDEX recipe_search_vector_idx ON foodgram_recipe USING gin (search_vector)',
+    # Конфигурация та же, что у запросов: RECIPE_SEARCH_CONFIG
+    """UPDATE foodgram_recipe r SET search_vector =
+        setweight(to_tsvector(%(config)s::regconfig, coalesce(r.name, '')), 'A')
+        || setweight(to_tsvector(%(config)s::regconfig, coalesce(
+            (SELECT string_agg(i.name, ' ')
+               FROM foodgram_recipeingredient ri
+               JOIN foodgram_ingredient i ON i.id = ri.ingredient_id
+              WHERE ri.recipe_id = r.id), '')), 'B')
+        || setweight(to_tsvector(%(config)s::regconfig, coalesce(r.text, '')), 'C')""",
+]
+POSTGRES_BACKWARD = 'DROP INDEX IF EXISTS recipe_search_vector_idx;'
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE foodgram_recipe_fts USING fts5("
+    "name, text, ingredients, tokenize='unicode61 remove_diacritics 2')",
+    """INSERT INTO foodgram_recipe_fts (rowid, name, text, ingredients)
+       SELECT r.id, r.name, r.text, coalesce(
+           (SELECT group_concat(i.name, ' ')
+              FROM foodgram_recipeingredient ri
+              JOIN foodgram_ingredient i ON i.id = ri.ingredient_id
+             WHERE ri.recipe_id = r.id), '')
+         FROM foodgram_recipe r""",
+]
+SQLITE_BACKWARD = ['DROP TABLE IF EXISTS foodgram_recipe_fts']
+
+
+def create_search_index(apps, schema_editor):
+    """GIN-индекс на PostgreSQL, FTS5-таблица на SQLite"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for sql in POSTGRES_FORWARD:
+            schema_editor.execute(sql, {'config': settings.RECIPE_SEARCH_CONFIG})
+    elif vendor == 'sqlite':
+        for sql in SQLITE_FORWARD:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_BACKWARD)
+    elif vendor == 'sqlite':
+        for sql in SQLITE_BACKWARD:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0015_shoplistingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
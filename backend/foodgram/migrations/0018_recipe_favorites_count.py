@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:38
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_favorites_count(apps, schema_editor):
+    Favorite = apps.get_model('foodgram', 'Favorite')
+    Recipe = apps.get_model('foodgram', 'Recipe')
+    Recipe.objects.update(favorites_count=Coalesce(Subquery(
+        Favorite.objects
+        .filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(total=Count('pk'))
+        .values('total')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0017_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(fill_favorites_count, migrations.RunPython.noop),
+    ]
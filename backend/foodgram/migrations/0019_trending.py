@@ -0,0 +1,53 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0018_recipe_favorites_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending_score', serialize=False, to='foodgram.recipe', verbose_name='Рецепт')),
+                ('log_score', models.FloatField(db_index=True, verbose_name='Логарифм рейтинга')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('favorite', 'Избранное'), ('cart', 'Корзина')], max_length=16, verbose_name='Событие')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='foodgram.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Событие рецепта',
+                'verbose_name_plural': 'События рецептов',
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(unique=True, verbose_name='Место')),
+                ('score', models.FloatField(verbose_name='Рейтинг на момент расчета')),
+                ('computed_at', models.DateTimeField(verbose_name='Время расчета')),
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trending', to='foodgram.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Популярный рецепт',
+                'verbose_name_plural': 'Популярные рецепты',
+                'ordering': ['position'],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:56
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Дубликаты (name, measurement_unit) сливаются в позицию с меньшим id"""
+    Ingredient = apps.get_model('foodgram', 'Ingredient')
+    RecipeIngredient = apps.get_model('foodgram', 'RecipeIngredient')
+    ShopListIngredient = apps.get_model('foodgram', 'ShopListIngredient')
+    groups = (Ingredient.objects
+              .values('name', 'measurement_unit')
+              .annotate(keep=Min('pk'), total=Count('pk'))
+              .filter(total__gt=1))
+    for group in groups:
+        duplicates = list(Ingredient.objects
+                          .filter(name=group['name'],
+                                  measurement_unit=group['measurement_unit'])
+                          .exclude(pk=group['keep'])
+                          .values_list('pk', flat=True))
+        RecipeIngredient.objects.filter(ingredient_id__in=duplicates).update(
+            ingredient_id=group['keep'])
+        for row in ShopListIngredient.objects.filter(ingredient_id__in=duplicates):
+            kept, _ = ShopListIngredient.objects.get_or_create(
+                user_id=row.user_id, ingredient_id=group['keep'], defaults={'amount': 0})
+            kept.amount += row.amount
+            kept.save(update_fields=['amount'])
+            row.delete()
+        Ingredient.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0020_feed'),
+    ]
+
+    # Ограничение добавляет следующая миграция: на PostgreSQL внешние ключи
+    # отложенные, и ALTER TABLE в одной транзакции с переносом строк падает
+    # с "pending trigger events"
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients, migrations.RunPython.noop),
+    ]
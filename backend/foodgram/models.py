@@ -1,5 +1,8 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Exists, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from hashids import Hashids
 
 hashids = Hashids(salt='pivo', min_length=3)
@@ -19,6 +22,14 @@ class User(AbstractUser):
                                upload_to='avatars/',
                                blank=True,
                                default='')
+    avatar_variants = models.JSONField('Варианты аватара',
+                                       default=dict,
+                                       blank=True,
+                                       editable=False)
+    # Лента читается из FeedItem, а не соединением с подписками
+    feed_materialized = models.BooleanField('Лента материализована',
+                                            default=False,
+                                            editable=False)
     REQUIRED_FIELDS = ['first_name', 'last_name', 'username', 'password']
     USERNAME_FIELD = 'email'
 
@@ -38,6 +49,10 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        indexes = [
+            models.Index(fields=['user', 'subscribed_to'],
+                         name='subscription_user_target_idx'),
+        ]
 
 
 class Ingredient(models.Model):
@@ -50,6 +65,54 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'measurement_unit'],
+                                    name='ingredient_name_unit_unique'),
+        ]
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Запросы рецептов для выдачи через API"""
+
+    def with_related(self):
+        """Автор одним JOIN, ингредиенты с количеством одним запросом"""
+        return self.defer('search_vector').select_related('author').prefetch_related(
+            Prefetch('recipeingredient_set',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')))
+
+    def with_user_flags(self, user):
+        """
+            Флаги is_favorited, is_in_shopping_cart и подписка на автора
+            вычисляются в SQL через EXISTS, а не отдельным запросом
+            на каждый рецепт.
+        """
+        if not user.is_authenticated:
+            return self.annotate(is_favorited=Value(False),
+                                 is_in_shopping_cart=Value(False),
+                                 author_is_subscribed=Value(False))
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShopList.objects.filter(
+                user=user, recipes=OuterRef('pk'))),
+            author_is_subscribed=Exists(Subscription.objects.filter(
+                user=user, subscribed_to=OuterRef('author'))),
+        )
+
+    def refresh_favorites_count(self):
+        """
+            Пересчитывает favorites_count по таблице избранного одним
+            UPDATE (после массовых вставок и загрузки фикстур).
+            Возвращает число обновленных рецептов.
+        """
+        return self.update(favorites_count=Coalesce(Subquery(
+            Favorite.objects
+            .filter(recipe=OuterRef('pk'))
+            .order_by()
+            .values('recipe')
+            .annotate(total=Count('pk'))
+            .values('total')), 0))
 
 
 class Recipe(models.Model):
@@ -59,6 +122,10 @@ class Recipe(models.Model):
                                verbose_name='Автор')
     name = models.CharField("Название", max_length=256)
     image = models.ImageField(upload_to='recipes/', verbose_name='Картинка')
+    image_variants = models.JSONField('Варианты картинки',
+                                      default=dict,
+                                      blank=True,
+                                      editable=False)
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(Ingredient,
                                          through='RecipeIngredient',
@@ -66,18 +133,38 @@ class Recipe(models.Model):
     cooking_time = models.PositiveIntegerField('Время приготовления')
     created_at = models.DateTimeField('Дата время создания',
                                       auto_now_add=True)
+    # Поддерживается сигналами Favorite через F(), сверяется
+    # командой reconcile_favorites_count
+    favorites_count = models.PositiveIntegerField('Добавлений в избранное',
+                                                  default=0,
+                                                  editable=False)
+    # Заполняется api.search.update_search_index, GIN-индекс создается
+    # миграцией только на PostgreSQL
+    search_vector = SearchVectorField('Поисковый вектор',
+                                      null=True,
+                                      editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'],
+                         name='recipe_created_at_id_idx'),
+            models.Index(fields=['-favorites_count', '-id'],
+                         name='recipe_favorites_count_idx'),
+            models.Index(fields=['author', '-created_at', '-id'],
+                         name='recipe_author_created_at_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
-    def get_short_link(self):
-        hashid = hashids.encode(self.id)
-        return ShortLink.objects.get_or_create(recipe=self, hashid=hashid)[0]
+    @property
+    def short_hashid(self):
+        return hashids.encode(self.id)
 
 
 class RecipeIngredient(models.Model):
@@ -133,6 +220,156 @@ class ShopList(models.Model):
         verbose_name_plural = 'Списки покупок'
 
 
+class ShopListIngredientQuerySet(models.QuerySet):
+    """Поддержка итогов корзины в актуальном состоянии"""
+
+    @staticmethod
+    def recipe_amounts(recipe_ids):
+        """Суммарное количество каждого ингредиента в рецептах"""
+        return dict(RecipeIngredient.objects
+                    .filter(recipe_id__in=recipe_ids)
+                    .values_list('ingredient_id')
+                    .annotate(total=Sum('amount'))
+                    .order_by())
+
+    def apply_deltas(self, user_ids, deltas):
+        """Прибавляет deltas {ingredient_id: количество} к итогам пользователей"""
+        deltas = {ingredient_id: delta
+                  for ingredient_id, delta in deltas.items() if delta}
+        user_ids = set(user_ids)
+        if not deltas or not user_ids:
+            return
+        try:
+            self._apply_deltas(user_ids, deltas)
+        except IntegrityError:
+            # Ту же строку итогов создал параллельный запрос: select_for_update
+            # блокировал только существующие строки. Теперь она есть и
+            # повторная попытка ее обновит
+            self._apply_deltas(user_ids, deltas)
+
+    def _apply_deltas(self, user_ids, deltas):
+        with transaction.atomic(using=self.db):
+            rows = {(row.user_id, row.ingredient_id): row
+                    for row in self.select_for_update().filter(
+                        user_id__in=user_ids, ingredient_id__in=deltas)}
+            to_create, to_update, to_delete = [], [], []
+            for user_id in user_ids:
+                for ingredient_id, delta in deltas.items():
+                    row = rows.get((user_id, ingredient_id))
+                    if row is None:
+                        if delta > 0:
+                            to_create.append(self.model(user_id=user_id,
+                                                        ingredient_id=ingredient_id,
+                                                        amount=delta))
+                        continue
+                    row.amount += delta
+                    if row.amount > 0:
+                        to_update.append(row)
+                    else:
+                        to_delete.append(row.pk)
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ['amount'])
+            self.filter(pk__in=to_delete).delete()
+
+    @staticmethod
+    def expected_totals():
+        """Итоги, посчитанные заново по корзинам: {(user_id, ingredient_id): количество}"""
+        rows = (RecipeIngredient.objects
+                .filter(recipe__shop_lists__isnull=False)
+                .values_list('recipe__shop_lists__user_id', 'ingredient_id')
+                .annotate(total=Sum('amount'))
+                .order_by())
+        return {(user_id, ingredient_id): total
+                for user_id, ingredient_id, total in rows if total > 0}
+
+    def rebuild(self):
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            self.bulk_create(
+                self.model(user_id=user_id, ingredient_id=ingredient_id,
+                           amount=amount)
+                for (user_id, ingredient_id), amount
+                in self.expected_totals().items())
+
+
+class ShopListIngredient(models.Model):
+    """Итоговое количество ингредиента в корзине пользователя"""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='shop_list_ingredients',
+                             verbose_name='Пользователь')
+    ingredient = models.ForeignKey(Ingredient,
+                                   on_delete=models.CASCADE,
+                                   verbose_name='Ингредиент')
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    objects = ShopListIngredientQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.amount} {self.ingredient.measurement_unit} {self.ingredient.name}"
+
+    class Meta:
+        unique_together = ('user', 'ingredient')
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списков покупок'
+
+
+class RecipeEvent(models.Model):
+    """
+        Добавление рецепта в избранное или корзину для рейтинга популярных
+        рецептов. Обработанные события удаляет update_trending.
+    """
+    FAVORITE = 'favorite'
+    CART = 'cart'
+    KINDS = ((FAVORITE, 'Избранное'),
+             (CART, 'Корзина'))
+
+    recipe = models.ForeignKey(Recipe,
+                               on_delete=models.CASCADE,
+                               related_name='events',
+                               verbose_name='Рецепт')
+    kind = models.CharField('Событие', max_length=16, choices=KINDS)
+    created_at = models.DateTimeField('Время', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Событие рецепта'
+        verbose_name_plural = 'События рецептов'
+
+
+class TrendingScore(models.Model):
+    """
+        Накопленный рейтинг рецепта: натуральный логарифм суммы весов
+        событий, умноженных на 2^((t - эпоха) / период полураспада).
+        Рейтинги сравнимы без пересчета затухания у всех рецептов.
+    """
+    recipe = models.OneToOneField(Recipe,
+                                  on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='trending_score',
+                                  verbose_name='Рецепт')
+    log_score = models.FloatField('Логарифм рейтинга', db_index=True)
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+
+
+class TrendingRecipe(models.Model):
+    """Снимок top-K популярных рецептов для /api/recipes/trending/"""
+    position = models.PositiveIntegerField('Место', unique=True)
+    recipe = models.OneToOneField(Recipe,
+                                  on_delete=models.CASCADE,
+                                  related_name='trending',
+                                  verbose_name='Рецепт')
+    score = models.FloatField('Рейтинг на момент расчета')
+    computed_at = models.DateTimeField('Время расчета')
+
+    class Meta:
+        ordering = ['position']
+        verbose_name = 'Популярный рецепт'
+        verbose_name_plural = 'Популярные рецепты'
+
+
 class ShortLink(models.Model):
     recipe = models.OneToOneField(Recipe,
                                   on_delete=models.CASCADE,
@@ -147,3 +384,91 @@ class ShortLink(models.Model):
     class Meta:
         verbose_name = 'Короткая ссылка'
         verbose_name_plural = 'Короткие ссылки'
+
+
+class FeedItemQuerySet(models.QuerySet):
+    """Материализованные ленты подписчиков с большим числом подписок"""
+
+    def materialize(self, user_id, batch_size=1000):
+        """Строит ленту пользователя заново и включает чтение из нее"""
+        recipes = (Recipe.objects
+                   .filter(author__subscribers__user_id=user_id)
+                   .values_list('pk', 'created_at')
+                   .order_by())
+        with transaction.atomic(using=self.db):
+            self.filter(user_id=user_id).delete()
+            self.bulk_create((self.model(user_id=user_id, recipe_id=recipe_id,
+                                         created_at=created_at)
+                              for recipe_id, created_at in recipes.iterator(chunk_size=batch_size)),
+                             batch_size=batch_size)
+            User.objects.filter(pk=user_id).update(feed_materialized=True)
+
+    def dematerialize(self, user_ids):
+        """Возвращает пользователей к чтению ленты соединением"""
+        with transaction.atomic(using=self.db):
+            User.objects.filter(pk__in=user_ids).update(feed_materialized=False)
+            self.filter(user_id__in=user_ids).delete()
+
+    def sync(self, threshold, batch_size=1000, rebuild=False):
+        """Материализует ленты пользователей с threshold и более подписками,
+        остальных возвращает к соединению; rebuild перестраивает и уже
+        материализованные ленты. Возвращает число включенных и выключенных лент"""
+        heavy = set(User.objects
+                    .annotate(follows=Count('subcriptions'))
+                    .filter(follows__gte=threshold)
+                    .values_list('pk', flat=True))
+        materialized = set(User.objects.filter(feed_materialized=True)
+                           .values_list('pk', flat=True))
+        stale = heavy if rebuild else heavy - materialized
+        for user_id in sorted(stale):
+            self.materialize(user_id, batch_size)
+        light = materialized - heavy
+        self.dematerialize(light)
+        return len(stale), len(light)
+
+    def add_author(self, user_id, author_id):
+        self.bulk_create((self.model(user_id=user_id, recipe_id=recipe_id,
+                                     created_at=created_at)
+                          for recipe_id, created_at
+                          in Recipe.objects.filter(author_id=author_id)
+                          .values_list('pk', 'created_at').order_by()),
+                         ignore_conflicts=True)
+
+    def fan_out(self, recipe):
+        """Добавляет новый рецепт в материализованные ленты подписчиков автора"""
+        followers = (Subscription.objects
+                     .filter(subscribed_to_id=recipe.author_id,
+                             user__feed_materialized=True)
+                     .values_list('user_id', flat=True))
+        self.bulk_create((self.model(user_id=user_id, recipe=recipe,
+                                     created_at=recipe.created_at)
+                          for user_id in followers),
+                         ignore_conflicts=True)
+
+
+class FeedItem(models.Model):
+    """Рецепт в материализованной ленте подписчика"""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='feed_items',
+                             verbose_name='Подписчик')
+    recipe = models.ForeignKey(Recipe,
+                               on_delete=models.CASCADE,
+                               related_name='feed_items',
+                               verbose_name='Рецепт')
+    # Копия Recipe.created_at: страница ленты читается по одному индексу
+    created_at = models.DateTimeField('Дата время создания рецепта')
+
+    objects = FeedItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='feed_item_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-recipe'],
+                         name='feed_item_user_created_at_idx'),
+        ]
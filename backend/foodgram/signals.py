@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Массовые изменения каталога ингредиентов (bulk_create/bulk_update не
+# посылают post_save). Аргументы: created_ids, updated_ids.
+ingredients_bulk_changed = Signal()
+
+# Массовое изменение полей рецептов, попадающих в выдачу API
+# (например, пересчет favorites_count). Аргумент: recipe_ids.
+recipes_bulk_changed = Signal()